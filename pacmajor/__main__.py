@@ -40,6 +40,15 @@ def get_options():
     action.add_argument('-P', '--git-pull-push', metavar="TARGET",
         help="Pull remote changes and push our changes",
         dest="backup", default=None, nargs='*')
+    action.add_argument('--migrate-git',
+        help="Move package histories into shared git object store",
+        dest="migrate_git", default=False, action="store_true")
+    action.add_argument('--clean-workspace',
+        help="Remove old package work trees from workspace_dir",
+        dest="clean_workspace", default=False, action="store_true")
+    action.add_argument('-o', '--owns', metavar="PATH",
+        help="Show packages owning files",
+        dest="owns", default=None, nargs='+')
     return ap
 
 def main():
@@ -59,6 +68,12 @@ def main():
     if options.backup is not None:
         manager.backup_git(targets=options.backup or None,
             packages=options.packages or None)
+    elif options.migrate_git:
+        manager.migrate_git()
+    elif options.clean_workspace:
+        manager.clean_workspace()
+    elif options.owns:
+        manager.show_owners(options.owns)
     else:
         if options.packages:
             manager.install_packages(options.packages)
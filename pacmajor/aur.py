@@ -1,10 +1,13 @@
-from urllib.request import urlopen
 from urllib.parse import urlencode
 import json
 
-def request(type, arg):
-    data = json.loads(urlopen('http://aur.archlinux.org/rpc.php?'
-        + urlencode(dict(type=type, arg=arg))).read().decode('ascii'))
+from . import net
+
+AUR_URL = 'http://aur.archlinux.org'
+
+def request(type, arg, base=AUR_URL):
+    data = json.loads(net.pool.get(base + '/rpc.php?'
+        + urlencode(dict(type=type, arg=arg))).decode('ascii'))
     if data['type'] == 'error':
         raise LookupError(data['results'])
     assert data['type'] == type
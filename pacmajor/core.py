@@ -4,10 +4,13 @@ import subprocess
 import tempfile
 import shutil
 
-from .util import Toolset
+from .util import Toolset, publish_file
 from .display import DisplayObject
-from .dep import DependencyChecker
-from .rorepo import LocalRepo, load_repos
+from .dep import DependencyChecker, DependencyCycle
+from .fileindex import FileIndex
+from .gitimport import SHARED_REPO, SNAPSHOT_FILE
+from .repodb import RepoDB, compression
+from .rorepo import LocalRepo, RepoIndex, load_repos, repo_order
 from .ui import PkgbuildMenu, InstallMenu
 from . import aur
 from . import pkgbuild
@@ -35,7 +38,10 @@ class Pacmajor(DisplayObject):
         self.localrepo = LocalRepo(self.root)
 
     def load_repos(self):
-        self.repos = load_repos(self.root)
+        self.repos = load_repos(self.root,
+            cache_dir=self.config.get('repo_cache'),
+            lazy=self.config.get('repo_lazy') == 'yes',
+            jobs=int(self.config.get('repo_jobs', 1)))
         val = self.config.get('ignore_repo')
         if val:
             if isinstance(val, str):
@@ -45,6 +51,55 @@ class Pacmajor(DisplayObject):
                 for name in val:
                     self.repos.pop(name, None)
                     self.repos.pop(name+'.db', None)
+        self.stock = RepoIndex(self.repos, repo_order(self.root))
+
+    def load_file_index(self):
+        cache = self.config.get('repo_cache')
+        if cache:
+            filename = os.path.join(cache, 'files.index')
+            self.fileindex = FileIndex.load(filename)
+            if self.fileindex.update(self.root):
+                self.fileindex.save(filename)
+        else:
+            self.fileindex = FileIndex()
+            self.fileindex.update(self.root)
+
+    def resolve_path(self, path):
+        """Resolves ``path`` to the form used in package file lists
+
+        Returns ``(path, real)`` where ``path`` is absolute within root and
+        ``real`` is its location on filesystem. Like ``pacman -Qo`` does,
+        symlinks are resolved in the directory part and the last component
+        is kept, because packages own symlinks themselves
+        """
+        root = os.path.realpath(self.root)
+        path = os.path.join(os.getcwd(), path)  # absolute path is kept
+        dir, base = os.path.split(path.rstrip('/') or '/')
+        dir = os.path.realpath(os.path.join(root, dir.lstrip('/')))
+        real = os.path.join(dir, base)
+        if os.path.isdir(real):
+            real = os.path.realpath(real)
+        rel = os.path.relpath(real, root)
+        return ('/' if rel == '.' else '/' + rel), real
+
+    def show_owners(self, paths):
+        with self.action("Reading file index"):
+            self.load_file_index()
+        for path in paths:
+            path, real = self.resolve_path(path)
+            if os.path.isdir(real):
+                pkgs = sorted(set(name
+                    for fn, name in self.fileindex.owners(path)))
+                if pkgs:
+                    print(path, 'has files of', ' '.join(pkgs))
+                else:
+                    print("No package owns files in", path)
+            else:
+                name = self.fileindex.owner(path)
+                if name:
+                    print(path, 'is owned by', name)
+                else:
+                    print("No package owns", path)
 
     def backup_git(self, targets=None, packages=None):
         if targets is None:
@@ -52,6 +107,10 @@ class Pacmajor(DisplayObject):
         if not targets:
             print("Configure some targets in pacmajor.conf", file=sys.stderr)
             sys.exit(1)
+        if self.config.get('git_layout') == 'shared':
+            for tgt in targets:
+                self.backup_shared(tgt, packages)
+            return
         if packages is None:
             more = True
             packages = [n for n in os.listdir(self.config['git_dir'])
@@ -107,17 +166,81 @@ class Pacmajor(DisplayObject):
                 self.toolset.git('--git-dir='+dir, 'push',
                     url.replace('$pkgname', i), *branches)
 
+    def backup_shared(self, name, packages):
+        url = self.config.get(name + '_url')
+        branches = self.config.get(name + '_branches')
+        if not url or not branches or '$pkgname' in url:
+            print("Target {0!r} configured incorrectly, shared layout"
+                " needs single repository url".format(name), file=sys.stderr)
+            return
+        shared = os.path.join(self.config['git_dir'], SHARED_REPO)
+        fetchspecs = []
+        pushspecs = []
+        for branch in branches:
+            force = ''
+            if branch.startswith('+'):
+                force = '+'
+                branch = branch[1:]
+            local, _, remote = branch.partition(':')
+            remote = remote or local
+            for pkg in packages or ['*']:
+                fetchspecs.append('{0}refs/pkg/{1}/{2}:refs/pkg/{1}/{3}'
+                    .format(force, pkg, remote, local))
+                pushspecs.append('{0}refs/pkg/{1}/{2}:refs/pkg/{1}/{3}'
+                    .format(force, pkg, local, remote))
+        with self.section('Pulling packages from {0}'.format(name)):
+            self.toolset.git('--git-dir='+shared, 'fetch', url, *fetchspecs)
+        with self.section('Pushing changes to {0}'.format(name)):
+            self.toolset.git('--git-dir='+shared, 'push', url, *pushspecs)
+
+    def migrate_git(self):
+        """Copies per-package repositories into the shared object store"""
+        gitdir = self.config['git_dir']
+        shared = os.path.join(gitdir, SHARED_REPO)
+        if not os.path.exists(shared):
+            os.makedirs(shared)
+            self.toolset.git('init', '--bare', shared)
+        snapdir = os.path.join(shared, SNAPSHOT_FILE + 's')
+        os.makedirs(snapdir, exist_ok=True)
+        for name in sorted(os.listdir(gitdir)):
+            if name.startswith('.'):
+                continue
+            with self.section('Importing {0}'.format(name)):
+                pkgdir = os.path.join(gitdir, name)
+                self.toolset.git('--git-dir='+shared, 'fetch', '--no-tags',
+                    pkgdir, '+refs/heads/*:refs/pkg/{0}/*'.format(name))
+                snapfile = os.path.join(pkgdir, SNAPSHOT_FILE)
+                if os.path.exists(snapfile):
+                    shutil.copyfile(snapfile, os.path.join(snapdir, name))
+        with self.section('Packing shared store'):
+            self.toolset.git('--git-dir='+shared, 'gc', '--quiet')
+        self.title("Set git_layout=shared in pacmajor.conf, old"
+            " repositories in {0} may be removed then".format(gitdir))
+
+    def clean_workspace(self):
+        dir = self.config.get('workspace_dir')
+        if not dir:
+            print("Configure workspace_dir in pacmajor.conf", file=sys.stderr)
+            sys.exit(1)
+        age = self.config.get('workspace_max_age')
+        size = self.config.get('workspace_max_size')
+        with self.section('Cleaning workspace {0}'.format(dir)) as act:
+            removed = pkgbuild.clean_workspace(dir,
+                max_age=int(age) * 86400 if age else None,
+                max_size=int(size) << 20 if size else None)
+            act.add('removed {0}: {1}'.format(len(removed),
+                ', '.join(removed) or '-'))
+
     def install_packages(self, names):
         stock = {}
         with self.action("Reading local repositories"):
             self.load_local()
         with self.action('Searching for stock packages') as act:
             self.load_repos()
-            for r in self.repos.values():
-                for n in names:
-                    p = r.packages.get(n)
-                    if p is not None:
-                        stock[n] = p
+            for n in names:
+                p = self.stock.find(n)
+                if p is not None:
+                    stock[n] = p
             act.add('found {0}'.format(len(stock)))
 
         nbuild = set(names) - set(stock)
@@ -128,15 +251,26 @@ class Pacmajor(DisplayObject):
         with pkgbuild.tmpdb(self) as pdb:
             with self.section('Gathering PKGBUILDs and dependencies') as act:
                 dep = DependencyChecker(nbuild)
-                dep.check(self, pdb)
+                gitcalls = self.toolset.git.calls
+                try:
+                    dep.check(self, pdb,
+                        jobs=int(self.config.get('fetch_jobs', 1)))
+                except pkgbuild.ImportFailed as e:
+                    print(e, file=sys.stderr)
+                    sys.exit(1)
+                act.add('fetched {0}, unchanged snapshots {1},'
+                    ' duplicates skipped {2}, git calls {3}'.format(
+                    len(pdb.packages), pdb.snapshot_hits, dep.dedup_hits,
+                    self.toolset.git.calls - gitcalls))
             if dep.stock_deps:
                 self.title("Installing following packages")
-                for pkg in dep.stock_deps:
-                    print_item(pkg.name)
+                for name in dep.stock_deps:
+                    self.print_item(name)
             aurinfo = {}
             for pkg in dep.aur_deps + dep.targetpkgs:
                 try:
-                    aurinfo[pkg.name] = aur.request('info', pkg.name)
+                    aurinfo[pkg.name] = aur.request('info', pkg.name,
+                        base=self.config.get('aur_url', aur.AUR_URL))
                 except LookupError as e:
                     pass
             PkgbuildMenu(self, pdb, dep.aur_deps + dep.targetpkgs, aurinfo,
@@ -144,7 +278,24 @@ class Pacmajor(DisplayObject):
             # TODO: recheck dependencies
             for pkg in dep.aur_deps + dep.targetpkgs:
                 pdb.commit(pkg.name, "Edited package file")
-            for typ, pkgs in dep.stage_sort():
+            repodir = self.config.get('repo_dir')
+            reponame = self.config.get('repo_name')
+            try:
+                stages = dep.stage_sort()
+            except DependencyCycle as e:
+                print(e, file=sys.stderr)
+                sys.exit(1)
+            if dep.stock_deps:
+                # upgrades of installed packages keep their install reason
+                upgrade = [n for n in dep.stock_deps
+                    if n in self.localrepo.packages]
+                new = [n for n in dep.stock_deps
+                    if n not in self.localrepo.packages]
+                if upgrade:
+                    self.toolset.install_sync(*upgrade)
+                if new:
+                    self.toolset.install_sync('--asdeps', *new)
+            for typ, pkgs in stages:
                 if typ == 'stock':
                     normal = [p for p in pkgs if p in stock]
                     deps = [p for p in pkgs if p not in stock]
@@ -153,8 +304,14 @@ class Pacmajor(DisplayObject):
                     if deps:
                         self.toolset.install_sync('--asdeps', *pkgs)
                 elif typ == 'aur':
-                    for name in pkgs:
-                        pdb.build_package(name)
+                    build = [p for p in pkgs
+                        if not pdb.reuse_package(p, repodir)]
+                    try:
+                        pdb.build_packages(build,
+                            jobs=int(self.config.get('build_jobs', 1)))
+                    except pkgbuild.BuildFailed as e:
+                        print(e, file=sys.stderr)
+                        sys.exit(1)
                     InstallMenu(self, pdb, pkgs).run()
                     normal = [pdb.package_file(p) for p in pkgs if p in nbuild]
                     deps = [pdb.package_file(p) for p in pkgs if p not in nbuild]
@@ -164,13 +321,37 @@ class Pacmajor(DisplayObject):
                         self.toolset.install_file('--asdeps', *deps)
                 else:
                     raise NotImplementedError(typ)
-            repodir = self.config.get('repo_dir')
-            reponame = self.config.get('repo_name')
             if repodir and reponame:
                 if not os.path.exists(repodir):
                     os.makedirs(repodir)
+                db = None
+                if not self.toolset.repo_add.overridden \
+                    and compression(reponame) is not None:
+                    db = RepoDB.load(os.path.join(repodir, reponame))
+                saved = 0
                 for pkg in dep.aur_deps + dep.targetpkgs:
+                    if pkg.name in pdb.prebuilt:
+                        continue
                     pfile = pdb.package_file(pkg.name)
                     tfile = os.path.join(repodir, os.path.basename(pfile))
-                    self.toolset.copy(pfile, tfile)
-                    self.toolset.repo_add(os.path.join(repodir,reponame), tfile)
+                    if self.toolset.copy.overridden:
+                        self.toolset.copy(pfile, tfile)
+                    else:
+                        method = publish_file(pfile, tfile)
+                        if method in ('hardlink', 'reflink'):
+                            saved += os.path.getsize(tfile)
+                        self.title("Published {0} by {1}".format(
+                            os.path.basename(tfile), method))
+                    if db is None:
+                        self.toolset.repo_add(os.path.join(repodir,reponame),
+                            tfile)
+                    else:
+                        db.add(tfile, manifest=pdb.package_manifest(pfile))
+                    pdb.save_stamp(pkg.name, tfile)
+                if saved:
+                    self.title("Data shared with build dir: {0}".format(
+                        self.fsize(saved)))
+                if db is not None and db.dirty:
+                    with self.action('Writing {0}'.format(reponame)) as act:
+                        db.save()
+                        act.add('{0} packages'.format(len(db.entries)))
@@ -1,7 +1,66 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from . import rorepo
 from .pkgbuild import PackageNotFound
+from .vercmp import parse_dep, satisfies
+
+class DependencyCycle(Exception):
+
+    def __init__(self, packages):
+        super().__init__(packages)
+        self.packages = packages
+
+    def __str__(self):
+        return "Dependency cycle between: " + ', '.join(self.packages)
+
+def cycles(nodes, edges):
+    """Returns strongly connected components of more than one node
+
+    Only ``nodes`` and edges between them are considered, ``edges`` maps
+    node to nodes it points to. Iterative Tarjan's algorithm
+    """
+    index = {}
+    low = {}
+    stack = []
+    onstack = set()
+    result = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(edges[root]))]
+        while work:
+            node, it = work[-1]
+            for nxt in it:
+                if nxt not in nodes:
+                    continue
+                if nxt not in index:
+                    index[nxt] = low[nxt] = len(index)
+                    stack.append(nxt)
+                    onstack.add(nxt)
+                    work.append((nxt, iter(edges[nxt])))
+                    break
+                if nxt in onstack:
+                    low[node] = min(low[node], index[nxt])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    comp = []
+                    while True:
+                        n = stack.pop()
+                        onstack.discard(n)
+                        comp.append(n)
+                        if n == node:
+                            break
+                    if len(comp) > 1:
+                        result.append(comp)
+    return result
 
 class DependencyChecker(object):
 
@@ -12,54 +71,121 @@ class DependencyChecker(object):
         self.aur_deps = []
         self.targetpkgs = []
         self.not_found = set()
+        self.dedup_hits = 0
+
+    def check(self, manager, pkgdb, jobs=1):
+        """Walks dependencies fetching PKGBUILDs in ``jobs`` threads
 
-    def check(self, manager, pkgdb):
-        future = list(self.targets)
+        Every name of the frontier is fetched as soon as it is discovered,
+        dependencies of a package are examined when its fetch finishes.
+        Each dependency is examined and each name is fetched only once,
+        repeated ones are counted in ``dedup_hits``
+        """
         already = set()
         localrepo = manager.localrepo
-        all_stock = defaultdict(list)
-        for k, v in manager.repos.items():
-            all_stock[k].extend(v.names)
-        while future:
-            name = future.pop()
+        stock = manager.stock
+        pending = {}
+        requested = set()
+
+        def visit(spec):
+            if spec in already:
+                self.dedup_hits += 1
+                return
+            already.add(spec)
+            name, op, ver = parse_dep(spec)
             if name in localrepo.names and not name in self.targets:
-                self.installed_deps.append(name)
-                continue
-            if name in all_stock:
-                self.stock_deps.append(name)
-                continue
-            try:
-                pkg = pkgdb.fetch(name)
-            except PackageNotFound:
-                self.not_found.add(name)
-                continue
-            for dep in pkg.makedepends:
-                if dep in already:
-                    continue
-                future.append(dep)
-            for dep in pkg.depends:
-                if dep in already:
-                    continue
-                future.append(dep)
-            if pkg.name in self.targets:
-                self.targetpkgs.append(pkg)
-            else:
-                self.aur_deps.append(pkg)
+                if any(satisfies(p, name, op, ver)
+                       for p in localrepo.names[name]):
+                    self.installed_deps.append(name)
+                    return
+            if name in stock:
+                if any(satisfies(p, name, op, ver)
+                       for rname, p in stock.get(name)):
+                    if name not in self.stock_deps:
+                        self.stock_deps.append(name)
+                    return
+            if name in requested:
+                self.dedup_hits += 1
+                return
+            requested.add(name)
+            pending[pool.submit(pkgdb.fetch, name)] = name
+
+        with ThreadPoolExecutor(max_workers=jobs or None) as pool:
+            for name in self.targets:
+                visit(name)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = pending.pop(fut)
+                    try:
+                        pkg = fut.result()
+                    except PackageNotFound:
+                        self.not_found.add(name)
+                        continue
+                    for dep in pkg.makedepend_specs:
+                        visit(dep)
+                    for dep in pkg.depend_specs:
+                        visit(dep)
+                    if pkg.name in self.targets:
+                        self.targetpkgs.append(pkg)
+                    else:
+                        self.aur_deps.append(pkg)
+
+    def levels(self):
+        """Splits packages into build levels
+
+        Packages of each level depend only on packages of previous levels,
+        so packages inside a level may be built concurrently. Raises
+        :class:`DependencyCycle` with packages on cycles if some packages
+        can't be ordered
+        """
+        items = self.targetpkgs + self.aur_deps
+        providers = defaultdict(list)
+        for i, pkg in enumerate(items):
+            providers[pkg.name].append(i)
+            for name in pkg.provides:
+                providers[name].append(i)
+        dependents = [set() for pkg in items]
+        requires = [None] * len(items)
+        indegree = [0] * len(items)
+        for i, pkg in enumerate(items):
+            deps = set()
+            for name in pkg.depends:
+                deps.update(providers.get(name, ()))
+            for name in pkg.makedepends:
+                deps.update(providers.get(name, ()))
+            deps.discard(i)
+            requires[i] = deps
+            for j in deps:
+                dependents[j].add(i)
+            indegree[i] = len(deps)
+        levels = []
+        cur = [i for i, n in enumerate(indegree) if not n]
+        done = 0
+        while cur:
+            levels.append([items[i].name for i in cur])
+            done += len(cur)
+            nxt = []
+            for i in cur:
+                for j in dependents[i]:
+                    indegree[j] -= 1
+                    if not indegree[j]:
+                        nxt.append(j)
+            nxt.sort()
+            cur = nxt
+        if done != len(items):
+            # the rest also has packages only depending on a cycle
+            rest = {i for i, n in enumerate(indegree) if n}
+            on_cycle = set()
+            for comp in cycles(rest, requires):
+                on_cycle.update(comp)
+            raise DependencyCycle([items[i].name for i in sorted(on_cycle)])
+        return levels
 
     def stage_sort(self):
         stages = []
-        items = {}
-        names = set()
-        for pkg in self.targetpkgs + self.aur_deps:
-            items[pkg.name] = pkg
-            names.add(pkg.name)
-            names.update(pkg.provides)
-        while names:
-            cur = []
-            for nn in items:
-                pkg = items[nn]
-                if not names & (set(pkg.depends) | set(pkg.makedepends)):
-                    cur.append(nn)
+        items = {pkg.name: pkg for pkg in self.targetpkgs + self.aur_deps}
+        for cur in self.levels():
             if not stages:
                 stock = []
                 aur = []
@@ -74,8 +200,25 @@ class DependencyChecker(object):
                     stages.append(('aur', aur))
             else:
                 stages.append(('aur', cur))
-            for nn in cur:
-                pkg = items.pop(nn)
-                names.remove(pkg.name)
-                names.difference_update(pkg.provides)
         return stages
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    class FakePackage(object):
+        def __init__(self, name, depends):
+            self.name = name
+            self.depends = depends
+            self.makedepends = []
+            self.provides = []
+
+    for size in (1000, 3000, 10000):
+        dep = DependencyChecker(())
+        for i in range(size):
+            dep.aur_deps.append(FakePackage('pkg{0}'.format(i),
+                ['pkg{0}'.format(random.randrange(i)) for j in range(3) if i]))
+        start = time.perf_counter()
+        levels = dep.stage_sort()
+        print("{0} packages: {1} levels in {2:.3f}s".format(
+            size, len(levels), time.perf_counter() - start))
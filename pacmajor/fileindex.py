@@ -0,0 +1,109 @@
+import os.path
+import pickle
+import bisect
+
+from .rorepo import LOCAL_REPO, read_entry
+
+INDEX_VERSION = 2
+
+class FileIndex(object):
+    """Maps files installed on the system to packages owning them
+
+    Index is built from ``files`` entries of the local database. Only
+    package directories whose mtime changed are re-read on ``update``.
+    Directories are not indexed, use ``owners`` to find packages having
+    files in a directory. Sorted list of paths for ``owners`` is saved
+    with the index, so it's sorted only when index changes
+    """
+
+    def __init__(self):
+        self.dirs = {}  # dir name -> (mtime, package name, paths)
+        self.files = {}
+        self._sorted = None
+
+    @classmethod
+    def load(cls, filename):
+        self = cls()
+        try:
+            with open(filename, 'rb') as file:
+                if pickle.load(file) == INDEX_VERSION:
+                    self.dirs, self._sorted = pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return self
+        for mtime, name, paths in self.dirs.values():
+            for path in paths:
+                self.files[path] = name
+        return self
+
+    def save(self, filename):
+        dir = os.path.dirname(filename)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(filename + '.tmp', 'wb') as file:
+            pickle.dump(INDEX_VERSION, file, pickle.HIGHEST_PROTOCOL)
+            # single dump shares path strings between both structures
+            pickle.dump((self.dirs, self.sorted_paths()), file,
+                pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.tmp', filename)
+
+    def update(self, root):
+        """Re-reads changed packages, returns number of them"""
+        dir = root + LOCAL_REPO
+        seen = set()
+        changed = 0
+        with os.scandir(dir) as it:
+            for item in it:
+                if not item.is_dir():
+                    continue  # ALPM_DB_VERSION
+                seen.add(item.name)
+                mtime = item.stat().st_mtime_ns
+                old = self.dirs.get(item.name)
+                if old is not None and old[0] == mtime:
+                    continue
+                if old is not None:
+                    self._remove(item.name)
+                name = item.name.rsplit('-', 2)[0]
+                entry = read_entry(os.path.join(item.path, 'files'),
+                    ('files',))
+                paths = tuple('/' + p
+                    for p in str(entry.get('files', b""), 'utf-8').splitlines()
+                    if not p.endswith('/'))
+                self.dirs[item.name] = (mtime, name, paths)
+                for path in paths:
+                    self.files[path] = name
+                changed += 1
+        for dname in set(self.dirs) - seen:
+            self._remove(dname)
+            changed += 1
+        if changed:
+            self._sorted = None
+        return changed
+
+    def _remove(self, dname):
+        mtime, name, paths = self.dirs.pop(dname)
+        for path in paths:
+            if self.files.get(path) == name:
+                del self.files[path]
+
+    def owner(self, path):
+        """Returns name of the package owning file ``path`` or None"""
+        return self.files.get('/' + path.lstrip('/'))
+
+    def sorted_paths(self):
+        if self._sorted is None:
+            self._sorted = sorted(self.files)
+        return self._sorted
+
+    def owners(self, prefix):
+        """Yields ``(path, package name)`` for every file in directory"""
+        paths = self.sorted_paths()
+        prefix = '/' + prefix.strip('/') + '/'
+        if prefix == '//':
+            prefix = '/'
+        idx = bisect.bisect_left(paths, prefix)
+        while idx < len(paths):
+            path = paths[idx]
+            if not path.startswith(prefix):
+                break
+            yield path, self.files[path]
+            idx += 1
@@ -0,0 +1,153 @@
+import os.path
+import fnmatch
+
+SHARED_REPO = '.shared'
+SNAPSHOT_FILE = 'pacmajor-snapshot'
+
+def set_head(gitdir, branch):
+    """Same as ``git symbolic-ref HEAD refs/heads/<branch>``"""
+    with open(os.path.join(gitdir, 'HEAD'), 'wt') as f:
+        f.write('ref: refs/heads/{0}\n'.format(branch))
+
+def read_ref(gitdir, ref):
+    """Returns commit ``ref`` points to or None if there is no such ref"""
+    try:
+        with open(os.path.join(gitdir, ref), 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(gitdir, 'packed-refs'), 'rt') as f:
+            for line in f:
+                if line.startswith(('#', '^')):
+                    continue
+                sha, name = line.split()
+                if name == ref:
+                    return sha
+    except OSError:
+        pass
+    return None
+
+def write_ref(gitdir, ref, sha):
+    """Same as ``git update-ref <ref> <sha>`` without the reflog"""
+    fn = os.path.join(gitdir, ref)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn + '.lock', 'wt') as f:
+        f.write(sha + '\n')
+    os.replace(fn + '.lock', fn)
+
+def list_refs(gitdir, prefix):
+    """Returns ``{ref: sha}`` for refs starting with ``prefix``"""
+    refs = {}
+    try:
+        with open(os.path.join(gitdir, 'packed-refs'), 'rt') as f:
+            for line in f:
+                if line.startswith(('#', '^')):
+                    continue
+                sha, name = line.split()
+                if name.startswith(prefix):
+                    refs[name] = sha
+    except OSError:
+        pass
+    for dir, dirs, files in os.walk(os.path.join(gitdir, prefix)):
+        for name in files:
+            if name.endswith('.lock'):
+                continue
+            fn = os.path.join(dir, name)
+            with open(fn, 'rt') as f:
+                refs[os.path.relpath(fn, gitdir)] = f.read().strip()
+    return refs
+
+def make_linked(gitdir, shared):
+    """Creates bare repository storing objects in ``shared`` one
+
+    Only HEAD and branches are kept in ``gitdir``. Automatic gc is
+    disabled, as it would prune objects of other repositories
+    """
+    os.makedirs(os.path.join(gitdir, 'refs', 'heads'))
+    os.symlink(os.path.abspath(os.path.join(shared, 'objects')),
+        os.path.join(gitdir, 'objects'))
+    with open(os.path.join(gitdir, 'config'), 'wt') as f:
+        f.write('[core]\n\trepositoryformatversion = 0\n\tbare = true\n'
+                '[gc]\n\tauto = 0\n')
+    set_head(gitdir, 'master')
+
+def file_mode(filename):
+    if os.path.islink(filename):
+        return '120000'
+    elif os.access(filename, os.X_OK):
+        return '100755'
+    return '100644'
+
+def tree_files(workdir, ignore=()):
+    """Yields ``(path, mode)`` of files to commit from ``workdir``"""
+    for dir, dirs, files in os.walk(workdir):
+        dirs.sort()
+        for name in sorted(files):
+            if any(fnmatch.fnmatch(name, pat) for pat in ignore):
+                continue
+            fn = os.path.join(dir, name)
+            yield os.path.relpath(fn, workdir), file_mode(fn)
+
+class FastImport(object):
+    """Writes commits into repository through single ``git fast-import``
+
+    Commits are written only after ``close()``
+    """
+
+    def __init__(self, toolset, gitdir, committer):
+        self.gitdir = gitdir
+        self.committer = committer.encode('utf-8')
+        self.proc = toolset.git.spawn('--git-dir='+gitdir,
+            'fast-import', '--quiet', '--date-format=now')
+        self.out = self.proc.stdin
+
+    def _data(self, data):
+        self.out.write('data {0}\n'.format(len(data)).encode('ascii'))
+        self.out.write(data)
+        self.out.write(b'\n')
+
+    def commit(self, branch, workdir, message, ignore=(), files=None):
+        """Commits snapshot of ``workdir`` on top of the ``branch``
+
+        Files absent in ``workdir`` are removed from the tree. If ``files``
+        are given, only they are committed
+        """
+        self.out.write('commit refs/heads/{0}\n'.format(branch)
+            .encode('utf-8'))
+        self.out.write(b'committer ' + self.committer + b' now\n')
+        self._data(message.encode('utf-8'))
+        parent = read_ref(self.gitdir, 'refs/heads/' + branch)
+        if parent is not None:
+            self.out.write('from {0}\n'.format(parent).encode('ascii'))
+        self.out.write(b'deleteall\n')
+        if files is None:
+            entries = tree_files(workdir, ignore)
+        else:
+            entries = ((path, file_mode(os.path.join(workdir, path)))
+                for path in sorted(files))
+        for path, mode in entries:
+            fn = os.path.join(workdir, path)
+            self.out.write('M {0} inline {1}\n'.format(mode, path)
+                .encode('utf-8'))
+            if mode == '120000':
+                self._data(os.readlink(fn).encode('utf-8'))
+            else:
+                with open(fn, 'rb') as f:
+                    self._data(f.read())
+        self.out.write(b'\n')
+
+    def branch(self, branch, start):
+        """Creates ``branch`` at ``start`` unless it already exists"""
+        if read_ref(self.gitdir, 'refs/heads/' + branch) is not None:
+            return
+        self.out.write('reset refs/heads/{0}\nfrom refs/heads/{1}\n\n'
+            .format(branch, start).encode('utf-8'))
+
+    def close(self):
+        """Finishes import, returns exit status of ``git fast-import``"""
+        try:
+            self.out.close()
+        except BrokenPipeError:
+            pass
+        return self.proc.wait()
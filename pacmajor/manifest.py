@@ -0,0 +1,114 @@
+import os.path
+import stat
+import gzip
+import re
+
+import archive
+
+MTREE_TYPES = {
+    b'file': stat.S_IFREG,
+    b'dir': stat.S_IFDIR,
+    b'link': stat.S_IFLNK,
+    b'block': stat.S_IFBLK,
+    b'char': stat.S_IFCHR,
+    b'fifo': stat.S_IFIFO,
+    b'socket': stat.S_IFSOCK,
+    }
+re_escape = re.compile(rb'\\([0-7]{3})')
+
+def _unescape(match):
+    return bytes([int(match.group(1), 8)])
+
+def parse_mtree(data):
+    """Returns manifest from uncompressed ``.MTREE`` of the package
+
+    Manifest is a list of ``(path, mode, size)`` tuples
+    """
+    defaults = {}
+    result = []
+    for line in data.splitlines():
+        if not line or line.startswith(b'#'):
+            continue
+        words = line.split()
+        if words[0] == b'/set':
+            defaults.update(w.split(b'=', 1) for w in words[1:])
+            continue
+        if words[0] == b'/unset':
+            for w in words[1:]:
+                defaults.pop(w, None)
+            continue
+        props = dict(defaults)
+        props.update(w.split(b'=', 1) for w in words[1:] if b'=' in w)
+        path = re_escape.sub(_unescape, words[0])
+        path = path.decode('utf-8', 'surrogateescape')
+        if path.startswith('./'):
+            path = path[2:]
+        mode = MTREE_TYPES.get(props.get(b'type', b'file'), 0) \
+            | int(props.get(b'mode', b'644'), 8)
+        size = int(props.get(b'size', 0)) if stat.S_ISREG(mode) else 0
+        result.append((path, mode, size))
+    return result
+
+def walk_tree(dir):
+    """Returns manifest of the package from ``pkg/<pkgname>`` of makepkg"""
+    result = []
+    for path, dirs, files in os.walk(dir):
+        dirs.sort()
+        for name in sorted(dirs + files):
+            fn = os.path.join(path, name)
+            st = os.lstat(fn)
+            size = st.st_size if stat.S_ISREG(st.st_mode) else 0
+            result.append((os.path.relpath(fn, dir), st.st_mode, size))
+    return result
+
+def read_package(filename):
+    """Returns manifest of the package file
+
+    Packages made by makepkg have ``.MTREE`` among first entries, only
+    the archive up to it is decompressed then. Other archives are
+    read completely
+    """
+    result = []
+    for entry in archive.Archive(filename):
+        if entry.filename == '.MTREE':
+            data = entry.read()
+            if data.startswith(b'\x1f\x8b'):
+                data = gzip.decompress(data)
+            return parse_mtree(data) + [('.MTREE', entry.mode, entry.size)]
+        size = entry.size if stat.S_ISREG(entry.mode) else 0
+        result.append((entry.filename, entry.mode, size))
+    return result
+
+def stats(manifest):
+    nfiles = 0
+    nbytes = 0
+    ndirs = 0
+    for path, mode, size in manifest:
+        if path.startswith('.'):  # all hidden in the root are special
+            continue
+        if stat.S_ISREG(mode):
+            nfiles += 1
+            nbytes += size
+        elif stat.S_ISDIR(mode):
+            ndirs += 1
+    return {
+        'files': nfiles,
+        'dirs': ndirs,
+        'unpacked': nbytes,
+        'elapsed': 0,
+        }
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    for filename in sys.argv[1:]:
+        start = time.perf_counter()
+        full = []
+        for entry in archive.Archive(filename):
+            full.append((entry.filename, entry.mode, entry.size))
+        middle = time.perf_counter()
+        manifest = read_package(filename)
+        end = time.perf_counter()
+        print("{0}: full read {1:.3f}s, manifest {2:.3f}s, {3}".format(
+            filename, middle - start, end - middle, stats(manifest)))
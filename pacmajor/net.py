@@ -0,0 +1,191 @@
+import time
+import socket
+import threading
+import http.client
+from collections import defaultdict
+from urllib.parse import urlsplit, urljoin
+
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# errors of reading response body, others raised by consumer aren't retried
+READ_ERRORS = (http.client.HTTPException, ConnectionError, socket.timeout)
+
+class HTTPError(Exception):
+
+    def __init__(self, url, status, reason):
+        super().__init__(url, status, reason)
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+    def __str__(self):
+        return '{0}: {1} {2}'.format(self.url, self.status, self.reason)
+
+class ConnectionPool(object):
+    """Keeps HTTP connections alive between requests to the same host
+
+    Failed requests (connection errors and 5xx responses) are retried
+    ``retries`` times with exponential backoff starting at ``backoff``
+    seconds. Safe to use from several threads
+    """
+
+    def __init__(self, retries=3, backoff=0.5, timeout=60):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.idle = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def _acquire(self, key, fresh=False):
+        """Returns ``(connection, reused)``, idle one unless ``fresh``"""
+        if not fresh:
+            with self.lock:
+                if self.idle[key]:
+                    return self.idle[key].pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return conn, False
+
+    def _release(self, key, conn, resp):
+        if resp.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                self.idle[key].append(conn)
+
+    def request(self, url, consume, redirects=MAX_REDIRECTS):
+        """Performs GET request, returns ``consume(response)``
+
+        Request on an idle connection the server has closed meanwhile
+        is repeated at once on a new connection, without backoff. Errors
+        raised by ``consume`` are not retried, unless they come from
+        reading the response
+        """
+        parts = urlsplit(url)
+        key = parts.scheme, parts.netloc
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        attempt = 0
+        fresh = False
+        while True:
+            conn, reused = self._acquire(key, fresh)
+            fresh = False
+            consuming = False
+            try:
+                try:
+                    conn.request('GET', path)
+                    resp = conn.getresponse()
+                except (OSError, http.client.HTTPException):
+                    if not reused:
+                        raise
+                    conn.close()
+                    fresh = True
+                    continue
+                if resp.status in REDIRECT_STATUSES:
+                    location = resp.getheader('Location')
+                    resp.read()
+                    self._release(key, conn, resp)
+                    conn = None
+                    if not redirects:
+                        raise HTTPError(url, resp.status, 'too many redirects')
+                    if location is None:
+                        raise HTTPError(url, resp.status, resp.reason)
+                    break
+                if resp.status >= 400:
+                    resp.read()
+                    self._release(key, conn, resp)
+                    conn = None
+                    if resp.status < 500 or attempt >= self.retries:
+                        raise HTTPError(url, resp.status, resp.reason)
+                else:
+                    consuming = True
+                    result = consume(resp)
+                    resp.read()
+                    self._release(key, conn, resp)
+                    return result
+            except (OSError, http.client.HTTPException) as e:
+                if conn is not None:
+                    conn.close()
+                if attempt >= self.retries \
+                    or consuming and not isinstance(e, READ_ERRORS):
+                    raise
+            except BaseException:
+                # response may be half read, connection can't be reused
+                if conn is not None:
+                    conn.close()
+                raise
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+        return self.request(urljoin(url, location), consume,
+            redirects=redirects-1)
+
+    def get(self, url):
+        return self.request(url, lambda resp: resp.read())
+
+    def download(self, url, filename):
+        """Streams body of the response into ``filename``"""
+        def write(resp):
+            with open(filename, 'wb') as f:
+                for chunk in iter(lambda: resp.read(65536), b''):
+                    f.write(chunk)
+        self.request(url, write)
+
+pool = ConnectionPool()
+
+if __name__ == '__main__':
+    import io
+    import os
+    import sys
+    import tarfile
+    import tempfile
+    import subprocess
+    from urllib.request import urlopen
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        data = b'pkgname=test\npkgver=1\npkgrel=1\narch=(any)\n'
+        info = tarfile.TarInfo('test/PKGBUILD')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    tarball = buf.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(tarball)))
+            self.end_headers()
+            self.wfile.write(tarball)
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:{0}/packages/'.format(server.server_port)
+    tmp = tempfile.mkdtemp()
+    def with_pool(url, fn):
+        pool.download(url, fn)
+    def with_urlopen(url, fn):
+        with open(fn, 'wb') as f:
+            f.write(urlopen(url).read())
+    def with_wget(url, fn):
+        subprocess.call(['wget', '-q', '-O', fn, url])
+    for func in (with_pool, with_urlopen, with_wget):
+        start = time.perf_counter()
+        try:
+            for i in range(count):
+                func('{0}p{1}.tar.gz'.format(base, i),
+                    os.path.join(tmp, 'p{0}.tar.gz'.format(i)))
+        except OSError as e:
+            print(func.__name__, 'failed:', e)
+            continue
+        print("{0}: {1} fetches in {2:.3f}s".format(func.__name__, count,
+            time.perf_counter() - start))
+    server.shutdown()
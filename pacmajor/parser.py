@@ -1,5 +1,6 @@
 import re
 import os.path
+import codecs
 import itertools
 
 re_tokenize = re.compile(r"""
@@ -128,20 +129,51 @@ class Function(Node):
     def parse(cls, name, body):
         return cls(name, list(body))
 
-def tokenize(file):
-    last_token = 0
-    last_line = 0
-    data = file.read().decode('utf-8')
-    for m in re_tokenize.finditer(data):
-        val = m.group(0)
-        typ = next(iter(k for k, v in m.groupdict().items() if v is not None))
-        last_line += data[last_token:m.start(0)].count('\n')
-        last_token = m.start(0)
-        try:
-            pos = last_token - data.rindex('\n', 0, last_token)
-        except ValueError:
-            pos = last_token  # first line
-        yield Token(typ, val, last_line, pos)
+def _cut(data):
+    """Returns end of the last complete line followed by non-blank
+
+    No token crosses such position. Returns 0 if there is none yet
+    """
+    pos = len(data)
+    while True:
+        pos = data.rfind('\n', 0, pos)
+        if pos < 0:
+            return 0
+        if pos + 1 < len(data) and not data[pos+1].isspace():
+            return pos + 1
+
+def tokenize(file, chunk_size=None):
+    """Yields tokens of the file
+
+    File is read at once, or by ``chunk_size`` bytes if specified.
+    ``lineno`` is zero-based, ``offset`` is counted from the preceding
+    newline, or from the start of the file for the first line
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    lineno = 0
+    last_nl = -1  # offset of the last newline seen
+    base = 0  # offset of data[0] in the file
+    data = ''
+    eof = False
+    while not eof:
+        if chunk_size is None:
+            data = decoder.decode(file.read(), True)
+            eof = True
+        else:
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            data += decoder.decode(chunk, eof)
+        end = len(data) if eof else _cut(data)
+        for m in re_tokenize.finditer(data, 0, end):
+            val = m.group()
+            start = base + m.start()
+            yield Token(m.lastgroup, val, lineno,
+                start if last_nl < 0 else start - last_nl)
+            if '\n' in val:
+                lineno += val.count('\n')
+                last_nl = start + val.rindex('\n')
+        data = data[end:]
+        base += end
 
 def parse(file):
     tok = tokenize(file)
@@ -188,3 +220,52 @@ def parse_vars(file):
         if isinstance(line, VarValue):
             values[line.name.value] = line.interpolate(values)
     return values
+
+if __name__ == '__main__':
+    import io
+    import sys
+    import time
+
+    def tokenize_old(file):
+        last_token = 0
+        last_line = 0
+        data = file.read().decode('utf-8')
+        for m in re_tokenize.finditer(data):
+            val = m.group(0)
+            typ = next(iter(k for k, v in m.groupdict().items()
+                if v is not None))
+            last_line += data[last_token:m.start(0)].count('\n')
+            last_token = m.start(0)
+            try:
+                pos = last_token - data.rindex('\n', 0, last_token)
+            except ValueError:
+                pos = last_token
+            yield Token(typ, val, last_line, pos)
+
+    def key(tokens):
+        return [(t.typ, t.value, t.lineno, t.offset) for t in tokens]
+
+    corpus = []
+    for fn in sys.argv[1:]:
+        with open(fn, 'rb') as f:
+            corpus.append(f.read())
+    if not corpus:
+        print("Usage: python -m pacmajor.parser PKGBUILD|makepkg.conf...",
+            file=sys.stderr)
+        sys.exit(1)
+    size = sum(map(len, corpus))
+    for name, func in (
+        ('old', tokenize_old),
+        ('new', tokenize),
+        ('new, 4k chunks', lambda f: tokenize(f, chunk_size=4096)),
+        ):
+        for data in corpus:
+            assert key(func(io.BytesIO(data))) == \
+                key(tokenize_old(io.BytesIO(data))), name
+        start = time.perf_counter()
+        for i in range(20):
+            for data in corpus:
+                for tok in func(io.BytesIO(data)):
+                    pass
+        print("{0}: {1:.1f} MB/s".format(name,
+            20 * size / (time.perf_counter() - start) / 1e6))
@@ -1,13 +1,23 @@
+import re
+import time
 import tempfile
 import shutil
 import os.path
 import stat
+import hashlib
+import tarfile
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
-import archive
-
+from . import aur
+from . import net
 from . import parser
+from .vercmp import parse_dep
 from . import display
+from .srccache import SourceCache, source_filename, source_protocol
+from .manifest import read_package, walk_tree, stats as manifest_stats
+from .gitimport import FastImport, set_head, list_refs, write_ref, tree_files
+from .gitimport import make_linked, SHARED_REPO, SNAPSHOT_FILE
 
 GIT_IGNORE = """
 *.swo
@@ -16,10 +26,161 @@ GIT_IGNORE = """
 *.orig
 *.bak
 """
+# makepkg output kept in persistent workspace, sources are added per package
+WORKSPACE_IGNORE = """/.pacmajor-files
+/src/
+/pkg/
+*.pkg.tar*
+*.log
+*.log.*
+"""
+WORKSPACE_MANIFEST = '.pacmajor-files'
 
 class PackageNotFound(Exception):
     pass
 
+class ImportFailed(Exception):
+
+    def __init__(self, name, status):
+        super().__init__(name, status)
+        self.name = name
+        self.status = status
+
+    def __str__(self):
+        return "git fast-import of {0} exited with status {1}".format(
+            self.name, self.status)
+
+class BuildFailed(Exception):
+
+    def __init__(self, name, status, log=None):
+        super().__init__(name, status, log)
+        self.name = name
+        self.status = status
+        self.log = log
+
+    def __str__(self):
+        msg = "Building {0} failed with status {1}".format(
+            self.name, self.status)
+        if self.log is not None:
+            msg += ", see " + self.log
+        return msg
+
+def _read_file(filename):
+    try:
+        with open(filename, 'rt') as f:
+            return f.read()
+    except OSError:
+        return None
+
+re_blank = re.compile(rb'[ \t\r\f\v]+')
+
+def _same_file(a, b):
+    try:
+        sa = os.lstat(a)
+        sb = os.lstat(b)
+    except OSError:
+        return False
+    if stat.S_IFMT(sa.st_mode) != stat.S_IFMT(sb.st_mode) \
+        or (sa.st_mode ^ sb.st_mode) & 0o111:
+        return False
+    if stat.S_ISLNK(sa.st_mode):
+        return os.readlink(a) == os.readlink(b)
+    if sa.st_size != sb.st_size:
+        return False
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+def _tree_size(dir):
+    total = 0
+    for path, dirs, files in os.walk(dir):
+        for name in files:
+            total += os.lstat(os.path.join(path, name)).st_size
+    return total
+
+def clean_workspace(dir, max_age=None, max_size=None):
+    """Removes work trees of packages from persistent workspace
+
+    Trees not fetched for ``max_age`` seconds are removed first, then
+    least recently fetched ones until workspace fits in ``max_size``.
+    Run directories left by interrupted or ``keep_files`` runs are removed
+    when older than ``max_age`` too. Returns names of removed directories
+    """
+    trees = []
+    removed = []
+    deadline = time.time() - max_age if max_age is not None else None
+    for name in os.listdir(dir):
+        path = os.path.join(dir, name)
+        if not os.path.isdir(path):
+            continue
+        if name.startswith('.run-'):
+            if deadline is not None and os.stat(path).st_mtime < deadline:
+                shutil.rmtree(path)
+                removed.append(name)
+            continue
+        if name.startswith('.'):
+            continue
+        try:
+            mtime = os.stat(os.path.join(path, WORKSPACE_MANIFEST)).st_mtime
+        except OSError:
+            mtime = os.stat(path).st_mtime
+        trees.append((mtime, name, path))
+    trees.sort()
+    if deadline is not None:
+        while trees and trees[0][0] < deadline:
+            mtime, name, path = trees.pop(0)
+            shutil.rmtree(path)
+            removed.append(name)
+    if max_size is not None:
+        sizes = [_tree_size(path) for mtime, name, path in trees]
+        total = sum(sizes)
+        for (mtime, name, path), size in zip(trees, sizes):
+            if total <= max_size:
+                break
+            shutil.rmtree(path)
+            removed.append(name)
+            total -= size
+    return removed
+
+class BadSnapshot(Exception):
+    pass
+
+class _HashingReader(object):
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        return data
+
+def extract_snapshot(file, outdir):
+    """Unpacks tar.gz stream into ``outdir``, returns its sha256
+
+    Only regular files and directories inside ``outdir`` are allowed
+    """
+    reader = _HashingReader(file)
+    with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+        for member in tar:
+            parts = member.name.split('/')
+            if member.name.startswith('/') or '..' in parts:
+                raise BadSnapshot("Bad path {0!r}".format(member.name))
+            path = os.path.join(outdir, *parts)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.isfile():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(tar.extractfile(member), f)
+                os.chmod(path, member.mode & 0o755 | 0o644)
+            else:
+                raise BadSnapshot("Bad file type of {0!r}"
+                    .format(member.name))
+    while reader.read(65536):
+        pass
+    return reader.hash.hexdigest()
+
 class PkgBuild(object):
 
     def __init__(self, file):
@@ -30,12 +191,12 @@ class PkgBuild(object):
         self.pkgver = self.vars['pkgver']
         self.pkgrel = self.vars['pkgrel']
         self.pkgname = self.vars['pkgname']
-        self.makedepends = [k.split('>=')[0]
-            for k in self.vars.get('makedepends', ())]
-        self.depends = [k.split('>=')[0]
-            for k in self.vars.get('depends', ())]
-        self.provides = [k.split('=')[0]
-            for k in self.vars.get('provides', ())]
+        self.makedepend_specs = list(self.vars.get('makedepends', ()))
+        self.depend_specs = list(self.vars.get('depends', ()))
+        self.provide_specs = list(self.vars.get('provides', ()))
+        self.makedepends = [parse_dep(k)[0] for k in self.makedepend_specs]
+        self.depends = [parse_dep(k)[0] for k in self.depend_specs]
+        self.provides = [parse_dep(k)[0] for k in self.provide_specs]
         self.arch = self.vars['arch']
         self.name = self.vars['pkgname']
         self.install = self.vars.get('install')
@@ -64,90 +225,255 @@ class TemporaryDB(object):
     def __init__(self, manager):
         self.manager = manager
         self.states = {}
+        self.digests = {}  # filename -> (stat key, digest, blank insensitive)
+        self.parsed = {}  # package -> digest of PKGBUILD it's parsed from
         self.packages = {}
+        self.snapshot_hits = 0
+        self.stamps = {}
+        self.prebuilt = {}
+        self.manifests = {}
+        self._committer = None
         self.gitdir = self.manager.config['git_dir']
         self.gitbranch = self.manager.config['git_my_branch']
+        self.shared = None
+        if self.manager.config.get('git_layout') == 'shared':
+            self.shared = os.path.join(self.gitdir, SHARED_REPO)
         makepkgconf = os.path.join(self.manager.root, 'etc/makepkg.conf')
         with open(makepkgconf, 'rb') as file:
             self.config = parser.parse_vars(file)
+        self.workspace = self.manager.config.get('workspace_dir')
+        self.sources = None
+        if self.manager.config.get('source_cache'):
+            size = self.manager.config.get('source_cache_size')
+            self.sources = SourceCache(self.manager.config['source_cache'],
+                max_size=int(size) << 20 if size else None)
 
     def __enter__(self):
-        self.dir = tempfile.mkdtemp()
-        self.edir = os.path.join(self.dir, 'empty')
+        if self.workspace:
+            os.makedirs(self.workspace, exist_ok=True)
+            self.dir = self.workspace
+            self.tmp = tempfile.mkdtemp(dir=self.workspace, prefix='.run-')
+            self.stage = os.path.join(self.tmp, 'stage')
+            os.mkdir(self.stage)
+        else:
+            self.dir = self.tmp = self.stage = tempfile.mkdtemp()
+        self.edir = os.path.join(self.tmp, 'empty')
         os.mkdir(self.edir)
+        if self.shared is not None and not os.path.exists(self.shared):
+            os.makedirs(self.shared)
+            self.manager.toolset.git('init', '--bare', self.shared)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.sources is not None:
+            self.sources.evict()
         if self.manager.keep_files:
-            self.manager.title("Files are left in {0}".format(self.dir))
+            self.manager.title("Files are left in {0}".format(self.tmp))
         else:
-            shutil.rmtree(self.dir)
+            shutil.rmtree(self.tmp)
 
     def fetch(self, name):
-        if not os.path.exists(self.gitdir):
-            os.makedirs(self.gitdir)
-        pkgdir = os.path.join(self.gitdir, name)
-        localgit = partial(self.manager.toolset.git,
-            '--git-dir='+pkgdir,
-            '--work-tree='+os.path.join(self.dir, name))
-        if not os.path.exists(pkgdir):
-            os.mkdir(pkgdir)
-            self.manager.toolset.git('init', '--bare', pkgdir)
-        tarurl = 'http://aur.archlinux.org/packages/{0}/{0}.tar.gz'\
-            .format(name)
-        tarname = '{0}/{1}.tar.gz'.format(self.dir, name)
-        self.manager.toolset.download(output=tarname, url=tarurl)
-        if not os.path.exists(tarname) or not os.path.getsize(tarname):
+        """Fetches package from AUR and imports it into git
+
+        Package is fetched only once per run. Import of unchanged AUR
+        snapshot into git is skipped, its hash is kept in git dir.
+        With ``workspace_dir`` configured, snapshot is unpacked aside and
+        only changed files are updated in the work tree of the package
+        """
+        try:
+            return self.packages[name]
+        except KeyError:
+            pass
+        pkgdir = self.package_gitdir(name)
+        snapshot = self.download_snapshot(name, self.stage)
+        if snapshot is None:
             if not self.manager.config.get('local_packages'):
                 raise PackageNotFound(name)
             localdir = os.path.join(self.manager.config['local_packages'], name)
             if os.path.exists(localdir):
                 with open(os.path.join(localdir, 'PKGBUILD'), 'rb') as f:
                     pkg = PkgBuild(f)
-                os.mkdir(os.path.join(self.dir, name))
+                os.mkdir(os.path.join(self.stage, name))
+                digest = hashlib.sha256()
                 for sname in pkg.source_files():
                     shutil.copyfile(os.path.join(localdir, sname),
-                        os.path.join(self.dir, name, sname))
+                        os.path.join(self.stage, name, sname))
+                    digest.update(sname.encode('utf-8') + b'\0')
+                    with open(os.path.join(localdir, sname), 'rb') as f:
+                        digest.update(f.read())
+                snapshot = 'local:' + digest.hexdigest()
             else:
                 raise PackageNotFound(name)
-        else:
-            self.manager.toolset.unpack(outdir=self.dir, filename=tarname)
-        with open(os.path.join(self.dir, name, '.gitignore'), 'wt') as f:
-            f.write(GIT_IGNORE)
-        with open(os.path.join(self.dir, name, 'PKGBUILD'), 'rb') as f:
+        with open(os.path.join(self.stage, name, 'PKGBUILD'), 'rb') as f:
             pkg = PkgBuild(f)
-        localgit('symbolic-ref', 'HEAD', 'refs/heads/aur')
-        localgit('add', '.')
-        localgit('commit',
-            '-m', 'Package version {0.pkgver!r} from aur'.format(pkg))
-        localgit('branch', self.gitbranch, 'aur')
-        localgit('symbolic-ref', 'HEAD', 'refs/heads/'+self.gitbranch)
+        with open(os.path.join(self.stage, name, '.gitignore'), 'wt') as f:
+            f.write(GIT_IGNORE)
+            if self.workspace:
+                f.write(WORKSPACE_IGNORE)
+                for source in pkg.source:
+                    filename, url = source_filename(source)
+                    if source_protocol(url) != 'local':
+                        f.write('/{0}\n'.format(filename))
+        files = None
+        if self.workspace:
+            files = self.update_workspace(name)
+        self.parsed[name] = self.file_digest(
+            os.path.join(self.dir, name, 'PKGBUILD'))[0]
+        snapfile = self.snapshot_file(name)
+        if _read_file(snapfile) == snapshot:
+            self.snapshot_hits += 1
+        else:
+            imp = FastImport(self.manager.toolset, pkgdir, self.committer())
+            try:
+                imp.commit('aur', os.path.join(self.dir, name),
+                    'Package version {0.pkgver!r} from aur\n'.format(pkg),
+                    ignore=GIT_IGNORE.split(), files=files)
+                imp.branch(self.gitbranch, 'aur')
+            except BrokenPipeError:
+                pass  # fast-import died, its status is reported below
+            status = imp.close()
+            if status != 0:
+                raise ImportFailed(name, status)
+            self.publish_refs(name)
+            os.makedirs(os.path.dirname(snapfile), exist_ok=True)
+            with open(snapfile, 'wt') as f:
+                f.write(snapshot)
+        set_head(pkgdir, self.gitbranch)
         self.packages[name] = pkg
         return pkg
 
+    def update_workspace(self, name):
+        """Moves changed files of staged snapshot into the work tree
+
+        Files of previous snapshot which are absent in the new one and
+        backups of edited files are removed, everything else (like
+        ``src`` of makepkg) is kept. Returns list of snapshot files
+        """
+        stage = os.path.join(self.stage, name)
+        workdir = os.path.join(self.dir, name)
+        manifest = os.path.join(workdir, WORKSPACE_MANIFEST)
+        old = set((_read_file(manifest) or '').splitlines())
+        files = []
+        for path, mode in tree_files(stage):
+            files.append(path)
+            src = os.path.join(stage, path)
+            dst = os.path.join(workdir, path)
+            if os.path.lexists(dst + '.orig'):
+                os.unlink(dst + '.orig')
+            if _same_file(src, dst):
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+        for path in old.difference(files):
+            if os.path.lexists(os.path.join(workdir, path)):
+                os.unlink(os.path.join(workdir, path))
+        with open(manifest, 'wt') as f:
+            f.write(''.join(path + '\n' for path in files))
+        shutil.rmtree(stage)
+        return files
+
+    def package_gitdir(self, name):
+        """Returns git dir of the package, creating it if needed
+
+        With ``git_layout=shared`` it's a temporary repository using the
+        object store of ``git_dir/.shared``, its branches are copied from
+        ``refs/pkg/<name>/`` of the store
+        """
+        if self.shared is None:
+            pkgdir = os.path.join(self.gitdir, name)
+            if not os.path.exists(pkgdir):
+                os.makedirs(pkgdir)
+                self.manager.toolset.git('init', '--bare', pkgdir)
+            return pkgdir
+        pkgdir = os.path.join(self.tmp, '.git', name)
+        if not os.path.exists(pkgdir):
+            make_linked(pkgdir, self.shared)
+            prefix = 'refs/pkg/{0}/'.format(name)
+            for ref, sha in list_refs(self.shared, prefix).items():
+                write_ref(pkgdir, 'refs/heads/' + ref[len(prefix):], sha)
+        return pkgdir
+
+    def publish_refs(self, name):
+        """Copies branches of the package into the shared store"""
+        if self.shared is None:
+            return
+        pkgdir = self.package_gitdir(name)
+        for ref, sha in list_refs(pkgdir, 'refs/heads/').items():
+            write_ref(self.shared, 'refs/pkg/{0}/{1}'.format(name,
+                ref[len('refs/heads/'):]), sha)
+
+    def snapshot_file(self, name):
+        if self.shared is None:
+            return os.path.join(self.gitdir, name, SNAPSHOT_FILE)
+        return os.path.join(self.shared, SNAPSHOT_FILE + 's', name)
+
+    def committer(self):
+        """Returns ``Name <email>`` of the git user"""
+        if self._committer is None:
+            ident = self.manager.toolset.git.output('var',
+                'GIT_COMMITTER_IDENT')
+            if ident is None:  # git has no identity configured
+                ident = 'pacmajor <pacmajor@localhost> 0 +0000'
+            self._committer = ident.rsplit(None, 2)[0]
+        return self._committer
+
+    def download_snapshot(self, name, outdir):
+        """Downloads and unpacks AUR snapshot of the package into ``outdir``
+
+        Returns sha256 of the snapshot or None if there is no such package.
+        Snapshot is unpacked while downloading, unless user has configured
+        own ``download`` or ``unpack`` tool
+        """
+        toolset = self.manager.toolset
+        tarurl = '{0}/packages/{1}/{1}.tar.gz'.format(
+            self.manager.config.get('aur_url', aur.AUR_URL), name)
+        if not toolset.download.overridden and not toolset.unpack.overridden:
+            try:
+                return net.pool.request(tarurl,
+                    partial(extract_snapshot, outdir=outdir))
+            except net.HTTPError as e:
+                if e.status != 404:
+                    raise
+                return None
+        tarname = '{0}/{1}.tar.gz'.format(self.tmp, name)
+        if toolset.download.overridden:
+            toolset.download(output=tarname, url=tarurl)
+        else:
+            try:
+                net.pool.download(tarurl, tarname)
+            except net.HTTPError as e:
+                if e.status != 404:
+                    raise
+        if not os.path.exists(tarname) or not os.path.getsize(tarname):
+            return None
+        with open(tarname, 'rb') as f:
+            snapshot = hashlib.sha256(f.read()).hexdigest()
+        toolset.unpack(outdir=outdir, filename=tarname)
+        return snapshot
+
     def merge(self, name, branch=None):
         for f in self.packages[name].files_to_edit():
             self.file_backup(name, f)
-        pkgdir = os.path.join(self.gitdir, name)
+        pkgdir = self.package_gitdir(name)
         localgit = partial(self.manager.toolset.git,
             '--git-dir='+pkgdir,
             '--work-tree='+os.path.join(self.dir, name),
             cwd=os.path.join(self.dir, name))  #needed for stash
         if branch is None or branch == self.gitbranch:
-            localgit('symbolic-ref', 'HEAD', 'refs/heads/aur')
+            set_head(pkgdir, 'aur')
             localgit('stash', 'save', 'starting merge')
-            localgit('symbolic-ref', 'HEAD', 'refs/heads/'+self.gitbranch)
+            set_head(pkgdir, self.gitbranch)
             localgit('reset', '--hard')
             localgit('merge', '--no-commit', 'aur')
             localgit('stash', 'pop')
         else:
-            localgit('symbolic-ref', 'HEAD', 'refs/heads/'+self.gitbranch)
+            set_head(pkgdir, self.gitbranch)
             localgit('merge', '--no-commit', branch)
         for f in self.packages[name].files_to_edit():
             self.file_check_state(name, f)
 
     def mergetool(self, name):
-        pkgdir = os.path.join(self.gitdir, name)
+        pkgdir = self.package_gitdir(name)
         localgit = partial(self.manager.toolset.git,
             '--git-dir='+pkgdir,
             '--work-tree='+os.path.join(self.dir, name),
@@ -157,13 +483,14 @@ class TemporaryDB(object):
     def commit(self, name, message):
         for f in self.packages[name].files_to_edit():
             self.file_backup(name, f)
-        pkgdir = os.path.join(self.gitdir, name)
+        pkgdir = self.package_gitdir(name)
         localgit = partial(self.manager.toolset.git,
             '--git-dir='+pkgdir,
             '--work-tree='+os.path.join(self.dir, name))
-        localgit('symbolic-ref', 'HEAD', 'refs/heads/'+self.gitbranch)
+        set_head(pkgdir, self.gitbranch)
         localgit('add', '.')
         localgit('commit', '-m', message)
+        self.publish_refs(name)
         for f in self.packages[name].files_to_edit():
             self.file_check_state(name, f)
 
@@ -178,45 +505,191 @@ class TemporaryDB(object):
     def file_get_state(self, pkg, file):
         return self.states.get((pkg, file), display.FILE_NEW)
 
+    def file_digest(self, filename):
+        """Returns ``(digest, digest ignoring blanks)`` of the file
+
+        Files are re-read only if their size, mtime or inode changed.
+        Returns None if there is no such file
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        key = st.st_size, st.st_mtime_ns, st.st_ino
+        cached = self.digests.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1:]
+        with open(filename, 'rb') as f:
+            data = f.read()
+        digests = (hashlib.sha1(data).digest(),
+            hashlib.sha1(re_blank.sub(b'', data)).digest())
+        self.digests[filename] = (key,) + digests
+        return digests
+
     def file_check_state(self, pkg, file, *, backup_suffix='.orig'):
         fn = os.path.join(self.dir, pkg, file)
-        if self.manager.toolset.compare(fn, fn+backup_suffix) == 0:
+        if self.manager.toolset.compare.overridden:
+            same = self.manager.toolset.compare(fn, fn+backup_suffix) == 0
+        else:
+            # same as ``diff -qw``, changes in blanks are not modifications
+            current = self.file_digest(fn)
+            orig = self.file_digest(fn+backup_suffix)
+            same = current is not None and orig is not None \
+                and current[1] == orig[1]
+        if same:
             self.states[pkg, file] = display.FILE_VIEWED
         else:
             self.states[pkg, file] = display.FILE_MODIFIED
-            pobj = self.packages[pkg]
-            try:
-                with open(os.path.join(self.dir, pkg, 'PKGBUILD'), 'rb') as f:
-                    pobj.update(f)
-            except Exception as e:
-                print(e)
-
-    def build_package(self, name):
-        with self.manager.section("Building " + name) as sect:
-            self.manager.toolset.build(
-                cwd=os.path.join(self.dir, name))
-            # makepkg changes version for git packages
-            self.file_check_state(name, 'PKGBUILD')
-            nfiles = 0
-            nbytes = 0
-            ndirs = 0
-            for file in archive.Archive(self.package_file(name)):
-                if file.filename.startswith('.'):  # all hidden in the root are special
-                    continue
-                if stat.S_ISREG(file.mode):
-                    nfiles += 1
-                    nbytes += file.size
-                elif stat.S_ISDIR(file.mode):
-                    ndirs += 1
-
-        self.packages[name].build_info = {
-            'files': nfiles,
-            'dirs': ndirs,
-            'unpacked': nbytes,
-            'elapsed': sect.elapsed,
-            }
+        pkgbuild = os.path.join(self.dir, pkg, 'PKGBUILD')
+        digest = self.file_digest(pkgbuild)
+        if digest is None or digest[0] == self.parsed.get(pkg):
+            return
+        try:
+            with open(pkgbuild, 'rb') as f:
+                self.packages[pkg].update(f)
+        except Exception as e:
+            print(e)
+        else:
+            self.parsed[pkg] = digest[0]
+
+    def build_packages(self, names, jobs=1):
+        """Builds packages which don't depend on each other in parallel
+
+        Unless ``MAKEFLAGS`` is set in environment or makepkg.conf,
+        ``make`` of each build gets equal share of CPUs
+        """
+        if jobs <= 1 or len(names) < 2:
+            for name in names:
+                self.build_package(name)
+            return
+        env = None
+        if 'MAKEFLAGS' not in os.environ and 'MAKEFLAGS' not in self.config:
+            env = dict(os.environ,
+                MAKEFLAGS='-j{0}'.format(max(1, os.cpu_count() // jobs)))
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(self.build_package, name, env=env,
+                quiet=True) for name in names]
+            for fut in futures:
+                fut.result()
+
+    def build_package(self, name, env=None, quiet=False):
+        """Runs makepkg for the package
+
+        When ``quiet``, output of makepkg goes to ``output_log`` of the
+        package and single line is printed when it's done, so concurrent
+        builds don't mix on the terminal. Raises :class:`BuildFailed` if
+        makepkg fails
+        """
+        if not quiet:
+            if os.path.exists(self.output_log(name)):
+                os.unlink(self.output_log(name))  # left by earlier run
+            with self.manager.section("Building " + name) as sect:
+                status = self._build(name, env, sect.add)
+            if status:
+                raise BuildFailed(name, status)
+            elapsed = sect.elapsed
+        else:
+            notes = []
+            start = time.time()
+            with open(self.output_log(name), 'wb') as log:
+                status = self._build(name, env, notes.append, output=log)
+            elapsed = time.time() - start
+            if status:
+                err = BuildFailed(name, status, self.output_log(name))
+                self.manager.title(str(err))
+                raise err
+            notes.insert(0, "Built {0} in {1:.2f}s".format(name, elapsed))
+            self.manager.title(', '.join(notes))
+        workdir = os.path.join(self.dir, name)
+        filename = self.package_file(name)
+        pkgname = self.packages[name].pkgname
+        pkgdir = os.path.join(workdir, 'pkg', pkgname)
+        if isinstance(pkgname, str) and os.path.isdir(pkgdir) \
+            and os.path.exists(filename):
+            self.manifests[filename] = walk_tree(pkgdir)
+        info = self.package_stats(filename)
+        info['elapsed'] = elapsed
+        self.packages[name].build_info = info
+
+    def _build(self, name, env, note, output=None):
+        workdir = os.path.join(self.dir, name)
+        if self.sources is not None:
+            n = self.sources.link(self.packages[name], workdir)
+            if n:
+                note('{0} sources taken from cache'.format(n))
+        if self.workspace and os.path.exists(self.package_file(name)):
+            # package of previous run must not be taken for a new one
+            os.unlink(self.package_file(name))
+        status = self.manager.toolset.build(cwd=workdir, env=env,
+            output=output)
+        # makepkg changes version for git packages
+        self.file_check_state(name, 'PKGBUILD')
+        if self.sources is not None:
+            dirs = [workdir]
+            if self.config.get('SRCDEST'):
+                dirs.append(self.config['SRCDEST'])
+            self.sources.store(self.packages[name], *dirs)
+        return status
+
+    def output_log(self, name):
+        return os.path.join(self.dir, name, 'pacmajor-build.log')
+
+    def package_manifest(self, filename):
+        """Returns ``(path, mode, size)`` of entries of the package file
+
+        Manifest is read once per artifact, for packages built in this
+        run it's taken from ``pkg/`` before they are compressed
+        """
+        try:
+            return self.manifests[filename]
+        except KeyError:
+            manifest = self.manifests[filename] = read_package(filename)
+            return manifest
+
+    def package_stats(self, filename):
+        return manifest_stats(self.package_manifest(filename))
+
+    def build_stamp(self, name):
+        """Returns string identifying sources of the package build
+
+        It consists of git tree of the package and build configuration
+        """
+        pkgdir = self.package_gitdir(name)
+        tree = self.manager.toolset.git.output('--git-dir='+pkgdir,
+            'rev-parse', '--verify', '-q',
+            'refs/heads/{0}^{{tree}}'.format(self.gitbranch))
+        if not tree:
+            return None
+        return '{0} {1[CARCH]} {1[PKGEXT]}\n'.format(tree.strip(), self.config)
+
+    def reuse_package(self, name, repodir):
+        """Uses package from ``repodir`` if it's built from the same tree
+
+        Returns True if package doesn't need to be built
+        """
+        stamp = self.stamps[name] = self.build_stamp(name)
+        if not repodir or stamp is None:
+            return False
+        filename = os.path.join(repodir,
+            os.path.basename(self.package_file(name)))
+        if not os.path.exists(filename) \
+            or _read_file(filename + '.tree') != stamp:
+            return False
+        self.manager.title("Package {0} is unchanged, using {1}"
+            .format(name, filename))
+        self.prebuilt[name] = filename
+        self.packages[name].build_info = self.package_stats(filename)
+        return True
+
+    def save_stamp(self, name, filename):
+        stamp = self.stamps.get(name)
+        if stamp is not None:
+            with open(filename + '.tree', 'wt') as f:
+                f.write(stamp)
 
     def package_file(self, name):
+        if name in self.prebuilt:
+            return self.prebuilt[name]
         pkg = self.packages[name]
         if pkg.arch == ['any']:
             arch = 'any'
@@ -228,6 +701,8 @@ class TemporaryDB(object):
 
     def buildlog_files(self, name):
         pkg = self.packages[name]
+        if os.path.exists(self.output_log(name)):
+            yield self.output_log(name)
         yield os.path.join(self.dir, name,
             '{0.pkgname}-{0.pkgver}-{0.pkgrel}-{1[CARCH]}-build.log'
             .format(pkg, self.config))
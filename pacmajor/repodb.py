@@ -0,0 +1,201 @@
+import os.path
+import io
+import stat
+import time
+import base64
+import hashlib
+import tarfile
+
+import archive
+
+from .rorepo import parse_buffer
+from .manifest import read_package
+
+COMPRESSION = {
+    '.tar': '',
+    '.tar.gz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tar.xz': 'xz',
+    }
+# order of fields the way repo-add writes them
+DESC_FIELDS = (
+    ('FILENAME', None),
+    ('NAME', 'pkgname'),
+    ('BASE', 'pkgbase'),
+    ('VERSION', 'pkgver'),
+    ('DESC', 'pkgdesc'),
+    ('GROUPS', 'group'),
+    ('CSIZE', None),
+    ('ISIZE', 'size'),
+    ('MD5SUM', None),
+    ('SHA256SUM', None),
+    ('PGPSIG', None),
+    ('URL', 'url'),
+    ('LICENSE', 'license'),
+    ('ARCH', 'arch'),
+    ('BUILDDATE', 'builddate'),
+    ('PACKAGER', 'packager'),
+    ('REPLACES', 'replaces'),
+    ('CONFLICTS', 'conflict'),
+    ('PROVIDES', 'provides'),
+    ('DEPENDS', 'depend'),
+    ('OPTDEPENDS', 'optdepend'),
+    ('MAKEDEPENDS', 'makedepend'),
+    ('CHECKDEPENDS', 'checkdepend'),
+    )
+
+def compression(filename):
+    """Returns tarfile compression for database, None if unsupported"""
+    for ext, comp in COMPRESSION.items():
+        if filename.endswith('.db' + ext):
+            return comp
+    return None
+
+def read_pkginfo(filename):
+    """Returns ``{key: [values]}`` from ``.PKGINFO`` of the package file"""
+    for entry in archive.Archive(filename):
+        if entry.filename == '.PKGINFO':
+            data = entry.read()
+            break
+    else:
+        raise ValueError("No .PKGINFO in {0}".format(filename))
+    info = {}
+    for line in data.decode('utf-8').splitlines():
+        if not line or line.startswith('#') or ' = ' not in line:
+            continue
+        k, v = line.split(' = ', 1)
+        info.setdefault(k, []).append(v)
+    return info
+
+def _hashes(filename):
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest()
+
+def format_desc(fields):
+    """Formats ``[(key, [values])]`` skipping empty ones"""
+    return ''.join('%{0}%\n{1}\n\n'.format(k, '\n'.join(v))
+        for k, v in fields if v).encode('utf-8')
+
+class RepoDB(object):
+    """Pacman repository database updated in process
+
+    Works like ``repo-add``, but database and files database are written
+    once by ``save``, however many packages are added or removed
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files_filename = filename.replace('.db.tar', '.files.tar', 1)
+        self.compression = compression(filename)
+        self.entries = {}  # name -> (dir name, {file name: contents})
+        self.dirty = False
+
+    @classmethod
+    def load(cls, filename):
+        self = cls(filename)
+        # files database also has everything from desc
+        for fn in (self.files_filename, self.filename):
+            if os.path.exists(fn):
+                self._read(fn)
+                break
+        return self
+
+    def _read(self, filename):
+        dirs = {}
+        for f in archive.Archive(filename):
+            if '/' not in f.filename:
+                continue
+            dir, name = f.filename.split('/', 1)
+            data = f.read()
+            if name and data:
+                dirs.setdefault(dir, {})[name] = data
+        for dir, files in dirs.items():
+            if 'desc' not in files:
+                continue
+            name = bytes(parse_buffer(files['desc'], ('name',))['name'])
+            self.entries[name.decode('utf-8').strip()] = (dir, files)
+
+    def add(self, filename, manifest=None):
+        """Adds package file replacing older package of the same name
+
+        ``manifest`` of the package is read from the file if not given
+        """
+        info = read_pkginfo(filename)
+        md5, sha256 = _hashes(filename)
+        extra = {
+            'FILENAME': [os.path.basename(filename)],
+            'CSIZE': [str(os.path.getsize(filename))],
+            'MD5SUM': [md5],
+            'SHA256SUM': [sha256],
+            }
+        if os.path.exists(filename + '.sig'):
+            with open(filename + '.sig', 'rb') as f:
+                extra['PGPSIG'] = [base64.b64encode(f.read()).decode('ascii')]
+        desc = format_desc((k, extra.get(k) if v is None else info.get(v))
+            for k, v in DESC_FIELDS)
+        if manifest is None:
+            manifest = read_package(filename)
+        paths = sorted(path + '/' if stat.S_ISDIR(mode) else path
+            for path, mode, size in manifest if not path.startswith('.'))
+        files = format_desc([('FILES', paths)])
+        name = info['pkgname'][0]
+        dir = '{0}-{1}'.format(name, info['pkgver'][0])
+        self.entries[name] = (dir, {'desc': desc, 'files': files})
+        self.dirty = True
+
+    def remove(self, name):
+        if self.entries.pop(name, None) is not None:
+            self.dirty = True
+
+    def _write(self, filename, with_files):
+        mtime = time.time()
+        tmpname = filename + '.tmp'
+        with tarfile.open(tmpname, 'w:' + self.compression) as tar:
+            for pkgname in sorted(self.entries):
+                dir, files = self.entries[pkgname]
+                info = tarfile.TarInfo(dir)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                info.mtime = mtime
+                tar.addfile(info)
+                for name in sorted(files):
+                    if name == 'files' and not with_files:
+                        continue
+                    info = tarfile.TarInfo(dir + '/' + name)
+                    info.size = len(files[name])
+                    info.mode = 0o644
+                    info.mtime = mtime
+                    tar.addfile(info, io.BytesIO(files[name]))
+        os.replace(tmpname, filename)
+        link = filename[:filename.rindex('.tar')]
+        if not os.path.lexists(link):
+            os.symlink(os.path.basename(filename), link)
+
+    def save(self):
+        """Writes database and files database if anything changed"""
+        if not self.dirty:
+            return False
+        self._write(self.filename, False)
+        self._write(self.files_filename, True)
+        self.dirty = False
+        return True
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python -m pacmajor.repodb DATABASE PACKAGE...",
+            file=sys.stderr)
+        sys.exit(1)
+    start = time.perf_counter()
+    db = RepoDB.load(sys.argv[1])
+    for fn in sys.argv[2:]:
+        db.add(fn)
+    db.save()
+    print("{0} packages added in {1:.3f}s, {2} in database".format(
+        len(sys.argv) - 2, time.perf_counter() - start, len(db.entries)))
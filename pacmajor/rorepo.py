@@ -1,35 +1,107 @@
 import os.path
+import re
+import pickle
+import hashlib
 from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from sys import intern
 
 import archive
 
 LOCAL_REPO = 'var/lib/pacman/local'
 REPO_DIR = 'var/lib/pacman/sync'
+PACMAN_CONF = 'etc/pacman.conf'
+CACHE_VERSION = 2
+INDEX_FIELDS = frozenset(('name', 'provides', 'replaces'))
+INTERNED_FIELDS = ('base', 'arch', 'packager', 'reason')
+TEXT_FIELDS = ('filename', 'desc', 'url')
+LIST_FIELDS = ('depends', 'makedepends', 'checkdepends', 'optdepends',
+    'provides', 'replaces', 'conflicts', 'groups', 'license')
+
+re_depname = re.compile(r'[^<>=:]*')
 
 def parse_properties(f):
-    body = f.read()
+    return parse_bytes(f.read())
+
+def parse_bytes(body, fields=None):
     items = body.split(b'\n\n')
     entry = {}
     for item in items:
         if not item:
             continue  # end of text
         if not b'\n' in item:
-            entry[item[1:-1].lower().decode('ascii')] = b""
+            k = item[1:-1].lower().decode('ascii')
+            v = b""
         else:
             k, v = item.split(b'\n', 1)
-            entry[k[1:-1].lower().decode('ascii')] = v
+            k = k[1:-1].lower().decode('ascii')
+        if fields is None or k in fields:
+            entry[k] = v
     return entry
 
+def parse_buffer(buf, fields=None, start=0, end=None):
+    """Parses entry in ``buf[start:end]`` without copying values
+
+    ``buf`` is anything having ``find`` method and supporting buffer
+    protocol (bytes, mmap). Values are memoryview slices of it
+    """
+    view = memoryview(buf)
+    if end is None:
+        end = len(buf)
+    entry = {}
+    pos = start
+    while pos < end:
+        nl = buf.find(b'\n', pos, end)
+        if nl < 0:
+            nl = end
+        if nl == pos:
+            pos += 1  # empty line
+            continue
+        k = str(view[pos+1:nl-1], 'ascii').lower()
+        stop = buf.find(b'\n\n', nl, end)
+        if stop < 0:
+            stop = end
+        if fields is None or k in fields:
+            entry[k] = view[nl+1:stop]
+        pos = stop + 2
+    return entry
+
+def read_entry(filename, fields=None):
+    with open(filename, 'rb') as file:
+        return parse_buffer(file.read(), fields)
+
+def dep_name(spec):
+    """Strips version from dependency, e.g. ``glibc>=2.17`` -> ``glibc``"""
+    return re_depname.match(spec).group(0)
+
 class Package(object):
+    """Package description, unknown fields of the entry are dropped
+
+    Names and dependency lists are interned, because the same strings are
+    repeated many times across all repositories
+    """
+    __slots__ = ('name', 'version', 'csize', 'isize')\
+        + INTERNED_FIELDS + TEXT_FIELDS + LIST_FIELDS
 
     def __init__(self, **kw):
-        for k, v in kw.items():
-            setattr(self, k, v)
-        self.name = self.name.decode('utf-8')
-        self.replaces = [a.decode('ascii')
-            for a in getattr(self, 'replaces', "").splitlines()]
-        self.provides = [a.decode('ascii')
-            for a in getattr(self, 'provides', "").splitlines()]
+        self.name = intern(str(kw['name'], 'utf-8'))
+        self.version = str(kw.get('version', b""), 'utf-8')
+        self.csize = int(str(kw.get('csize') or b"0", 'ascii'))
+        self.isize = int(str(kw.get('isize') or kw.get('size') or b"0",
+            'ascii'))
+        for k in INTERNED_FIELDS:
+            v = kw.get(k)
+            setattr(self, k, None if v is None else intern(str(v, 'utf-8')))
+        for k in TEXT_FIELDS:
+            v = kw.get(k)
+            setattr(self, k, None if v is None else str(v, 'utf-8'))
+        for k in LIST_FIELDS:
+            setattr(self, k, tuple(intern(a)
+                for a in str(kw.get(k, b""), 'utf-8').splitlines()))
+
+    def __repr__(self):
+        return '<Package {0}-{1}>'.format(self.name, self.version)
 
 class Repo(object):
 
@@ -41,42 +113,323 @@ class Repo(object):
         self.packages[p.name] = p
         self.names[p.name].append(p)
         for i in p.replaces:
-            self.names[i].append(p)
+            self.names[dep_name(i)].append(p)
         for i in p.provides:
-            self.names[i].append(p)
+            self.names[dep_name(i)].append(p)
+
+
+class LocalPackage(Package):
+    """Package of local database, ``files`` are read on first access"""
+    __slots__ = ('path', '_files')
+
+    def __init__(self, path, **kw):
+        self.path = path
+        files = kw.pop('files', None)
+        self._files = None if files is None else bytes(files)
+        super().__init__(**kw)
+
+    @property
+    def files(self):
+        if self._files is None:
+            entry = read_entry(os.path.join(self.path, 'files'), ('files',))
+            self._files = bytes(entry.get('files', b""))
+        return self._files
 
+def iter_local(dir):
+    """Yields ``(path, desc entry)`` for every package in local database"""
+    with os.scandir(dir) as it:
+        for item in it:
+            if not item.is_dir():
+                continue  # ALPM_DB_VERSION
+            yield item.path, read_entry(os.path.join(item.path, 'desc'))
 
 class LocalRepo(Repo):
-    def __init__(self, root):
+    def __init__(self, root, files=False):
         super().__init__()
-        dir = root + LOCAL_REPO
-        for rawname in os.listdir(dir):
-            with open(os.path.join(dir, rawname, 'desc'), 'rb') as file:
-                entry = parse_properties(file)
-            with open(os.path.join(dir, rawname, 'files'), 'rb') as file:
-                entry.update(parse_properties(file))
-            self.add_package(Package(**entry))
+        for path, entry in iter_local(root + LOCAL_REPO):
+            if files:
+                entry.update(read_entry(os.path.join(path, 'files')))
+            self.add_package(LocalPackage(path, **entry))
+
+def scan_database(filename):
+    """Reads database into a single buffer and builds name index
+
+    Returns tuple ``(buffer, offsets, names)``, where ``offsets`` maps
+    package name to the list of ``(start, end)`` slices of its entries
+    in ``buffer`` and ``names`` maps every name, provided or replaced
+    name to the list of package names
+    """
+    buf = bytearray()
+    slices = defaultdict(list)
+    index = defaultdict(dict)
+    for f in archive.Archive(filename):
+        data = f.read()
+        if not data:
+            continue  # directory
+        dir = f.filename.rsplit('/', 1)[0]
+        slices[dir].append((len(buf), len(buf) + len(data)))
+        buf += data
+        for k, v in parse_buffer(data, INDEX_FIELDS).items():
+            index[dir][k] = bytes(v)
+    offsets = {}
+    names = defaultdict(list)
+    for dir, props in index.items():
+        name = props['name'].decode('utf-8')
+        offsets[name] = slices[dir]
+        names[name].append(name)
+        for i in props.get('replaces', b"").splitlines():
+            names[dep_name(i.decode('utf-8'))].append(name)
+        for i in props.get('provides', b"").splitlines():
+            names[dep_name(i.decode('utf-8'))].append(name)
+    return bytes(buf), offsets, dict(names)
+
+class LazyPackages(Mapping):
+    """Mapping of package name to :class:`Package` decoded on first access"""
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.cache = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        entry = {}
+        for start, end in self.offsets[name]:
+            entry.update(parse_buffer(self.buffer, start=start, end=end))
+        pkg = self.cache[name] = Package(**entry)
+        return pkg
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+class LazyNames(Mapping):
+
+    def __init__(self, packages, names):
+        self.packages = packages
+        self.names = names
+
+    def __getitem__(self, name):
+        return [self.packages[n] for n in self.names[name]]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
 
 class ReadonlyRepo(Repo):
 
-    def __init__(self, filename):
+    def __init__(self, filename, data=None, lazy=False):
         super().__init__()
-        arch = archive.Archive(filename)
-        all = {}
-        for f in arch:
-            entry = parse_properties(f)
-            pkgname = f.filename.rsplit('/', 1)[0]
-            if pkgname in all:
-                all[pkgname].update(entry)
-            else:
-                all[pkgname] = entry
-        for namever, props in all.items():
-            p = Package(**props)
-            self.add_package(p)
-
-def load_repos(root):
-    repos = {}
-    for i in os.listdir(root + REPO_DIR):
-        repos[i] = ReadonlyRepo(root + REPO_DIR+'/'+i)
-    return repos
+        if data is None:
+            data = scan_database(filename)
+        buffer, offsets, names = data
+        if lazy:
+            self.packages = LazyPackages(buffer, offsets)
+            self.names = LazyNames(self.packages, names)
+        else:
+            for pkg in LazyPackages(buffer, offsets).values():
+                self.add_package(pkg)
+
+class RepoIndex(object):
+    """Merged name index of all sync repositories
+
+    Maps every package, provided and replaced name to the list of
+    repositories having it, in the order of priority from pacman.conf
+    """
+
+    def __init__(self, repos, order=()):
+        self.names = defaultdict(list)
+        prio = {name: i for i, name in enumerate(order)}
+        def key(rname):
+            name = rname[:-3] if rname.endswith('.db') else rname
+            return prio.get(name, len(prio)), rname
+        for rname in sorted(repos, key=key):
+            repo = repos[rname]
+            for name in repo.names:
+                self.names[name].append((rname, repo))
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def get(self, name):
+        """Returns list of ``(repo name, package)`` matching ``name``"""
+        return [(rname, pkg)
+            for rname, repo in self.names.get(name, ())
+            for pkg in repo.names[name]]
+
+    def find(self, name):
+        """Returns package named exactly ``name`` with highest priority"""
+        for rname, repo in self.names.get(name, ()):
+            pkg = repo.packages.get(name)
+            if pkg is not None:
+                return pkg
+        return None
+
+def repo_order(root):
+    """Returns names of repositories in the order listed in pacman.conf"""
+    order = []
+    try:
+        with open(root + PACMAN_CONF, 'rt') as file:
+            for line in file:
+                line = line.strip()
+                if line.startswith('[') and line.endswith(']'):
+                    if line != '[options]':
+                        order.append(line[1:-1])
+    except OSError:
+        pass
+    return order
+
+class RepoCache(object):
+    """Keeps parsed sync databases in ``dir``
+
+    Cache file is valid while path, size and mtime of the database are the
+    same, so it's invalidated by ``pacman -Sy`` automatically
+    """
+
+    def __init__(self, dir):
+        self.dir = dir
+
+    def key(self, filename):
+        st = os.stat(filename)
+        return (CACHE_VERSION, os.path.abspath(filename),
+            st.st_size, st.st_mtime_ns)
+
+    def cache_file(self, filename):
+        digest = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+        return os.path.join(self.dir, '{0}-{1}.cache'.format(
+            os.path.basename(filename), digest.hexdigest()[:8]))
+
+    def get(self, filename, key):
+        try:
+            with open(self.cache_file(filename), 'rb') as file:
+                if pickle.load(file) == key:
+                    return pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+        return None
+
+    def store(self, filename, key, data):
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        cfile = self.cache_file(filename)
+        tmpname = cfile + '.tmp'
+        with open(tmpname, 'wb') as file:
+            pickle.dump(key, file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, cfile)
+
+def load_repos(root, cache_dir=None, lazy=False, jobs=1):
+    """Loads all sync databases
+
+    Databases that are not in cache are scanned by pool of ``jobs``
+    processes (``0`` means number of CPUs)
+    """
+    cache = RepoCache(cache_dir) if cache_dir else None
+    files = {i: root + REPO_DIR+'/'+i for i in os.listdir(root + REPO_DIR)}
+    data = {}
+    keys = {}
+    if cache is not None:
+        for i, filename in files.items():
+            keys[i] = cache.key(filename)
+            data[i] = cache.get(filename, keys[i])
+    missing = [i for i in files if data.get(i) is None]
+    if jobs != 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=jobs or None) as pool:
+            data.update(zip(missing,
+                pool.map(scan_database, [files[i] for i in missing])))
+    else:
+        for i in missing:
+            data[i] = scan_database(files[i])
+    if cache is not None:
+        for i in missing:
+            cache.store(files[i], keys[i], data[i])
+    return {i: ReadonlyRepo(files[i], data[i], lazy=lazy) for i in files}
+
+if __name__ == '__main__':
+    import sys
+    import time
+    import tracemalloc
+
+    class DictPackage(object):
+        """Package as it was kept before ``__slots__``, for comparison
+
+        Every field of the entry is stored as bytes in ``__dict__``,
+        only name, provides and replaces are decoded
+        """
+
+        def __init__(self, **kw):
+            self.__dict__.update(kw)
+            self.name = self.name.decode('utf-8')
+            self.replaces = [a.decode('ascii')
+                for a in kw.get('replaces', b"").splitlines()]
+            self.provides = [a.decode('ascii')
+                for a in kw.get('provides', b"").splitlines()]
+
+    def load_dicts(root):
+        """Loads all databases into :class:`DictPackage` objects
+
+        Local packages have ``files`` read as well, as it was done
+        """
+        repos = {}
+        for i in os.listdir(root + REPO_DIR):
+            entries = defaultdict(dict)
+            for f in archive.Archive(root + REPO_DIR + '/' + i):
+                dir = f.filename.rsplit('/', 1)[0]
+                entries[dir].update(parse_bytes(f.read()))
+            repo = repos[i] = Repo()
+            for entry in entries.values():
+                if 'name' in entry:
+                    repo.add_package(DictPackage(**entry))
+        local = Repo()
+        dir = root + LOCAL_REPO
+        for name in os.listdir(dir):
+            if not os.path.isdir(os.path.join(dir, name)):
+                continue  # ALPM_DB_VERSION
+            entry = {}
+            for fn in ('desc', 'files'):
+                with open(os.path.join(dir, name, fn), 'rb') as file:
+                    entry.update(parse_properties(file))
+            local.add_package(DictPackage(**entry))
+        return repos, local
 
+    root = sys.argv[1] if len(sys.argv) > 1 else '/'
+    for label, load in (
+            ('dict packages', load_dicts),
+            ('slotted packages', lambda root: (load_repos(root),
+                LocalRepo(root)))):
+        tracemalloc.start()
+        repos, local = load(root)
+        cur, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{0}: loaded {1} sync and {2} local packages,"
+            " memory: {3:.1f} MiB, peak: {4:.1f} MiB".format(label,
+            sum(len(r.packages) for r in repos.values()),
+            len(local.packages), cur / 1048576, peak / 1048576))
+        del repos, local
+    corpus = []
+    for path, entry in iter_local(root + LOCAL_REPO):
+        for name in ('desc', 'files'):
+            with open(os.path.join(path, name), 'rb') as file:
+                corpus.append(file.read())
+    for fields in (None, INDEX_FIELDS):
+        for func in (parse_bytes, parse_buffer):
+            start = time.perf_counter()
+            for i in range(20):
+                for body in corpus:
+                    func(body, fields)
+            print("{0} of {1} entries x20, fields {2}: {3:.3f}s".format(
+                func.__name__, len(corpus), fields and sorted(fields) or 'all',
+                time.perf_counter() - start))
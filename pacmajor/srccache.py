@@ -0,0 +1,151 @@
+import os.path
+import hashlib
+import tempfile
+import shutil
+
+# strongest first, it's used as a key when there are several arrays
+CHECKSUMS = (
+    ('sha512sums', 'sha512'),
+    ('b2sums', 'blake2b'),
+    ('sha384sums', 'sha384'),
+    ('sha256sums', 'sha256'),
+    ('sha224sums', 'sha224'),
+    ('sha1sums', 'sha1'),
+    ('md5sums', 'md5'),
+    )
+VCS_PROTOCOLS = {'bzr', 'fossil', 'git', 'hg', 'svn'}
+
+def source_protocol(url):
+    """Returns protocol of source as makepkg does, ``local`` for files"""
+    if '://' in url:
+        return url.split('://', 1)[0].split('+', 1)[0]
+    if 'lp:' in url:
+        return url.split('+lp:', 1)[0]
+    return 'local'
+
+def source_filename(source):
+    """Returns ``(filename, url)`` for the entry of ``source`` array
+
+    Filename is the one makepkg uses, so for VCS sources it's the name of
+    the clone in the package directory
+    """
+    if '::' in source:
+        filename, url = source.split('::', 1)
+    else:
+        filename, url = None, source
+    proto = source_protocol(url)
+    if proto not in VCS_PROTOCOLS:
+        return filename or url.rsplit('/', 1)[-1], url
+    if filename is None:
+        filename = url.split('#', 1)[0].split('?', 1)[0].rstrip('/')
+        filename = filename.rsplit('/', 1)[-1]
+    filename = filename.split('#', 1)[0].split('?', 1)[0]
+    if proto == 'bzr':
+        filename = filename.split('lp:', 1)[-1]
+    elif proto == 'fossil':
+        filename += '.fossil'
+    elif proto == 'git':
+        filename = filename.split('.git', 1)[0]
+    return filename, url
+
+def file_hash(filename, algo):
+    h = hashlib.new(algo)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class SourceCache(object):
+    """Content-addressed store of downloaded sources
+
+    Sources are keyed by the strongest checksum from PKGBUILD, or by URL
+    if checksum is ``SKIP``. Files are symlinked into the package
+    directory before ``makepkg``, so it doesn't download them. Least
+    recently used files are evicted when store exceeds ``max_size``
+    """
+
+    def __init__(self, dir, max_size=None):
+        self.dir = dir
+        self.max_size = max_size
+
+    def sources(self, pkg):
+        """Yields ``(filename, url, algo, checksum)`` of remote sources"""
+        sums = ()
+        algo = None
+        for var, name in CHECKSUMS:
+            if var in pkg.vars:
+                sums = pkg.vars[var]
+                algo = name
+                break
+        for i, source in enumerate(pkg.source):
+            filename, url = source_filename(source)
+            proto = source_protocol(url)
+            if proto == 'local' or proto in VCS_PROTOCOLS:
+                continue
+            checksum = sums[i] if i < len(sums) else 'SKIP'
+            if checksum == 'SKIP':
+                yield filename, url, None, None
+            else:
+                yield filename, url, algo, checksum.lower()
+
+    def path(self, url, algo, checksum):
+        if algo is None:
+            return os.path.join(self.dir, 'url',
+                hashlib.sha256(url.encode('utf-8')).hexdigest())
+        return os.path.join(self.dir, algo, checksum)
+
+    def link(self, pkg, workdir):
+        """Symlinks cached sources into ``workdir``, returns their number"""
+        count = 0
+        for filename, url, algo, checksum in self.sources(pkg):
+            target = os.path.join(workdir, filename)
+            cached = self.path(url, algo, checksum)
+            if os.path.lexists(target) or not os.path.exists(cached):
+                continue
+            os.utime(cached)  # mark as recently used
+            os.symlink(cached, target)
+            count += 1
+        return count
+
+    def store(self, pkg, *dirs):
+        """Puts sources downloaded by ``makepkg`` into the store
+
+        Sources are looked up in ``dirs`` in order, files whose checksum
+        doesn't match PKGBUILD are not stored
+        """
+        for filename, url, algo, checksum in self.sources(pkg):
+            cached = self.path(url, algo, checksum)
+            if os.path.exists(cached):
+                continue
+            for dir in dirs:
+                fn = os.path.join(dir, filename)
+                if os.path.isfile(fn) and not os.path.islink(fn):
+                    break
+            else:
+                continue
+            if algo is not None and file_hash(fn, algo) != checksum:
+                continue
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(cached))
+            os.close(fd)
+            shutil.copyfile(fn, tmpname)
+            os.replace(tmpname, cached)
+
+    def evict(self):
+        """Removes least recently used files above ``max_size``"""
+        if not self.max_size or not os.path.exists(self.dir):
+            return
+        files = []
+        total = 0
+        for dir, dirs, names in os.walk(self.dir):
+            for name in names:
+                fn = os.path.join(dir, name)
+                st = os.stat(fn)
+                files.append((st.st_mtime, st.st_size, fn))
+                total += st.st_size
+        files.sort()
+        for mtime, size, fn in files:
+            if total <= self.max_size:
+                break
+            os.unlink(fn)
+            total -= size
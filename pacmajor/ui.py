@@ -1,8 +1,6 @@
 import sys
 import os
 
-import archive
-
 from .display import Menu, DoneException, extractcommands
 
 @extractcommands
@@ -143,8 +141,9 @@ class InstallMenu(Menu):
     def cmd_list(self, letters:'LETTERS') -> 'l':
         """list package contents"""
         for name in self.letters_to_names(letters):
-            for fn in archive.Archive(self.pkgdb.package_file(name)):
-                print(name + ':', fn.filename)
+            filename = self.pkgdb.package_file(name)
+            for path, mode, size in self.pkgdb.package_manifest(filename):
+                print(name + ':', path)
 
     def cmd_log(self, letters:'LETTERS') -> ('bl', 'buildlog', 'build_log'):
         """show build log files"""
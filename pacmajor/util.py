@@ -1,7 +1,55 @@
 import subprocess
 import shlex
+import shutil
+import fcntl
 import os
 
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+
+def _clone(fsrc, fdst):
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return 'reflink'
+    except OSError:
+        pass
+    size = os.fstat(fsrc.fileno()).st_size
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            while copied < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                    size - copied)
+                if not n:
+                    break
+                copied += n
+        except OSError:
+            pass
+        if copied == size:
+            return 'copy_file_range'
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    return 'copy'
+
+def publish_file(src, dst):
+    """Puts ``src`` to ``dst`` sharing data if filesystem allows it
+
+    Tries hardlink, reflink and ``copy_file_range`` before copying data
+    through userspace. Returns name of the method used
+    """
+    tmp = dst + '.part'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    try:
+        os.link(src, tmp)
+        method = 'hardlink'
+    except OSError:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            method = _clone(fsrc, fdst)
+    os.replace(tmp, dst)
+    return method
+
 class Tool(object):
     """Single tool that runs from a command-line
 
@@ -13,6 +61,7 @@ class Tool(object):
     def __init__(self, cmdline, manager, pager=None):
         self.manager = manager
         self.pager = pager
+        self.calls = 0
         self.update(cmdline)
 
     def update(self, cmdline):
@@ -21,14 +70,24 @@ class Tool(object):
             for i, arg in enumerate(self.cmdline)
             if arg.startswith('$')}
 
-    def __call__(self, *args, cwd=None, env=None, filter=None, **kw):
-        """Execute the tool with pager if needed"""
+    def __call__(self, *args, cwd=None, env=None, filter=None, output=None,
+        **kw):
+        """Execute the tool with pager if needed
+
+        If ``output`` file is given, both stdout and stderr go there and
+        the tool can't read terminal
+        """
         cmdline = list(self.cmdline)
         cmdline.extend(args)
         for k, v in kw.items():
             cmdline[self.indexes[k]] = v
         self.manager.commandline(cmdline)
-        if filter:
+        self.calls += 1
+        if output is not None:
+            proc = subprocess.Popen(cmdline, stdin=subprocess.DEVNULL,
+                stdout=output, stderr=output, cwd=cwd, env=env)
+            return proc.wait()
+        elif filter:
             proc = subprocess.Popen(cmdline, stdout=filter.stdin,
                 cwd=cwd, env=env)
             return proc.wait()
@@ -42,6 +101,28 @@ class Tool(object):
                 cwd=cwd, env=env)
             return proc.wait()
 
+    def output(self, *args, cwd=None, env=None):
+        """Execute the tool and return its output, None if tool failed"""
+        cmdline = list(self.cmdline)
+        cmdline.extend(args)
+        self.manager.commandline(cmdline)
+        self.calls += 1
+        proc = subprocess.Popen(cmdline, stdout=subprocess.PIPE,
+            cwd=cwd, env=env)
+        out = proc.communicate()[0]
+        if proc.returncode:
+            return None
+        return out.decode('utf-8')
+
+    def spawn(self, *args, cwd=None, env=None):
+        """Start the tool with a pipe to its input, returns Popen object"""
+        cmdline = list(self.cmdline)
+        cmdline.extend(args)
+        self.manager.commandline(cmdline)
+        self.calls += 1
+        return subprocess.Popen(cmdline, stdin=subprocess.PIPE,
+            cwd=cwd, env=env)
+
     def filter(self, pipe=None):
         """Filter data through tool"""
         if pipe is None:
@@ -91,6 +172,7 @@ class Toolset(object):
         self.manager.tool_selected(name, cmdline)
         self.tools[name] = Tool(cmdline, manager=self.manager,
             pager=self.tools['pager'] if pager else None)
+        self.tools[name].overridden = cmdline != default
 
     def update(self, name, cmdline):
         self.tools[name].update(cmdline)
@@ -0,0 +1,212 @@
+import re
+from functools import lru_cache
+
+re_dep = re.compile(r'^(.*?)(?:(<=|>=|<|>|=)(.*))?$', re.S)
+
+OPERATORS = {
+    '<': lambda r: r < 0,
+    '<=': lambda r: r <= 0,
+    '=': lambda r: r == 0,
+    '>=': lambda r: r >= 0,
+    '>': lambda r: r > 0,
+    }
+
+def _isdigit(c):
+    return '0' <= c <= '9'
+
+def _isalpha(c):
+    return 'a' <= c <= 'z' or 'A' <= c <= 'Z'
+
+def _isalnum(c):
+    return _isdigit(c) or _isalpha(c)
+
+def parse_evr(evr):
+    """Splits version into ``(epoch, version, release)``
+
+    Release is None if there is no ``-`` in the version
+    """
+    i = 0
+    while i < len(evr) and _isdigit(evr[i]):
+        i += 1
+    if i < len(evr) and evr[i] == ':':
+        epoch = evr[:i] or '0'
+        evr = evr[i+1:]
+    else:
+        epoch = '0'
+    version, sep, release = evr.rpartition('-')
+    if not sep:
+        return epoch, release, None
+    return epoch, version, release
+
+def rpmvercmp(a, b):
+    """Compares single version segment the way rpm does"""
+    if a == b:
+        return 0
+    one = two = 0  # start of current segment
+    ptr1 = ptr2 = 0  # end of previous segment
+    la = len(a)
+    lb = len(b)
+    while one < la and two < lb:
+        while one < la and not _isalnum(a[one]):
+            one += 1
+        while two < lb and not _isalnum(b[two]):
+            two += 1
+        if one >= la or two >= lb:
+            break
+        if one - ptr1 != two - ptr2:  # different separator lengths
+            return -1 if one - ptr1 < two - ptr2 else 1
+        ptr1 = one
+        ptr2 = two
+        if _isdigit(a[ptr1]):
+            while ptr1 < la and _isdigit(a[ptr1]):
+                ptr1 += 1
+            while ptr2 < lb and _isdigit(b[ptr2]):
+                ptr2 += 1
+            isnum = True
+        else:
+            while ptr1 < la and _isalpha(a[ptr1]):
+                ptr1 += 1
+            while ptr2 < lb and _isalpha(b[ptr2]):
+                ptr2 += 1
+            isnum = False
+        if two == ptr2:
+            # numeric segments are always newer than alpha segments
+            return 1 if isnum else -1
+        seg1 = a[one:ptr1]
+        seg2 = b[two:ptr2]
+        if isnum:
+            seg1 = seg1.lstrip('0')
+            seg2 = seg2.lstrip('0')
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+        one = ptr1
+        two = ptr2
+    if one >= la and two >= lb:
+        return 0
+    # remaining alpha string never beats an empty string
+    if one >= la and not (two < lb and _isalpha(b[two])) \
+        or one < la and _isalpha(a[one]):
+        return -1
+    return 1
+
+@lru_cache(maxsize=65536)
+def vercmp(a, b):
+    """Compares two ``epoch:version-release`` strings
+
+    Returns negative, zero or positive number like pacman's vercmp does
+    """
+    if a == b:
+        return 0
+    epoch1, ver1, rel1 = parse_evr(a)
+    epoch2, ver2, rel2 = parse_evr(b)
+    ret = rpmvercmp(epoch1, epoch2)
+    if ret == 0:
+        ret = rpmvercmp(ver1, ver2)
+        if ret == 0 and rel1 is not None and rel2 is not None:
+            ret = rpmvercmp(rel1, rel2)
+    return ret
+
+@lru_cache(maxsize=65536)
+def parse_dep(spec):
+    """Splits dependency like ``glibc>=2.17`` into ``(name, op, version)``
+
+    Operator and version are None for unversioned dependency
+    """
+    name, op, version = re_dep.match(spec).groups()
+    return name, op, version
+
+def check(version, op, required):
+    """Checks whether ``version`` satisfies ``op required`` constraint"""
+    if op is None:
+        return True
+    return OPERATORS[op](vercmp(version, required))
+
+def satisfies(pkg, name, op, required):
+    """Checks whether package or one of its provides satisfies dependency
+
+    Versioned dependency can't be satisfied by unversioned provides,
+    as in pacman
+    """
+    if pkg.name == name and check(pkg.version, op, required):
+        return True
+    for spec in pkg.provides:
+        pname, pop, pver = parse_dep(spec)
+        if pname != name:
+            continue
+        if op is None or pop == '=' and check(pver, op, required):
+            return True
+    return False
+
+# cases from test/util/vercmptest.sh of pacman, checked in both orders
+VERCMP_TESTS = (
+    ('1.5.0', '1.5.0', 0),
+    ('1.5.1', '1.5.0', 1),
+    ('1.5.1', '1.5', 1),
+    ('1.5.0-1', '1.5.0-1', 0),
+    ('1.5.0-1', '1.5.0-2', -1),
+    ('1.5.0-1', '1.5.1-1', -1),
+    ('1.5.0-2', '1.5.1-1', -1),
+    ('1.5-1', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-2', -1),
+    ('1.5', '1.5-1', 0),
+    ('1.5-1', '1.5', 0),
+    ('1.1-1', '1.1', 0),
+    ('1.0-1', '1.1', -1),
+    ('1.1-1', '1.0', 1),
+    ('1.5b-1', '1.5-1', -1),
+    ('1.5b', '1.5', -1),
+    ('1.5b-1', '1.5', -1),
+    ('1.5b', '1.5.1', -1),
+    ('1.0a', '1.0alpha', -1),
+    ('1.0alpha', '1.0b', -1),
+    ('1.0b', '1.0beta', -1),
+    ('1.0beta', '1.0rc', -1),
+    ('1.0rc', '1.0', -1),
+    ('1.5.a', '1.5', 1),
+    ('1.5.b', '1.5.a', 1),
+    ('1.5.1', '1.5.b', 1),
+    ('1.5.b-1', '1.5.b', 0),
+    ('1.5-1', '1.5.b', -1),
+    ('2.0', '2_0', 0),
+    ('2.0_a', '2_0.a', 0),
+    ('2.0a', '2.0.a', -1),
+    ('2___a', '2_a', 1),
+    ('0:1.0', '0:1.0', 0),
+    ('0:1.0', '0:1.1', -1),
+    ('1:1.0', '0:1.0', 1),
+    ('1:1.0', '0:1.1', 1),
+    ('1:1.0', '2:1.1', -1),
+    ('1:1.0', '0:1.0-1', 1),
+    ('1:1.0-1', '0:1.1-1', 1),
+    ('0:1.0', '1.0', 0),
+    ('0:1.0', '1.1', -1),
+    ('0:1.1', '1.0', 1),
+    ('1:1.0', '1.0', 1),
+    ('1:1.0', '1.1', 1),
+    ('1:1.1', '1.1', 1),
+    )
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) == 3:
+        print(vercmp(*sys.argv[1:]))
+        sys.exit(0)
+    if len(sys.argv) != 1:
+        print("Usage: python -m pacmajor.vercmp [VERSION1 VERSION2]",
+            file=sys.stderr)
+        sys.exit(2)
+    failed = 0
+    for a, b, expected in VERCMP_TESTS:
+        for a, b, expected in ((a, b, expected), (b, a, -expected)):
+            result = vercmp(a, b)
+            if result != expected:
+                print("vercmp({0!r}, {1!r}) = {2}, expected {3}".format(
+                    a, b, result, expected))
+                failed += 1
+    print("{0} of {1} checks failed".format(
+        failed, len(VERCMP_TESTS) * 2))
+    sys.exit(1 if failed else 0)